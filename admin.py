@@ -2,16 +2,38 @@
 Admin handlers for the Telegram bot
 """
 import os
-import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from telegram.error import TelegramError
 
 from config import ADMIN_IDS, BOOKS_DIR, MAX_FILE_SIZE
 from database.db_manager import DatabaseManager
+from database.segments import PRESET_SEGMENTS, segment_sizes
+from handlers.inline import invalidate_search_cache
+from utils.scheduler import Priority
+from utils import async_files
+from utils.reachability import reachability, unreachable_reason
+from utils.profiler import slow_log
 
 # Conversation states
-WAITING_BOOK_CODE, WAITING_BOOK_TITLE, WAITING_BOOK_FILE, WAITING_TEST_FILE, WAITING_BROADCAST_MESSAGE = range(5)
+(
+    WAITING_BOOK_CODE,
+    WAITING_BOOK_TITLE,
+    WAITING_BOOK_FILE,
+    WAITING_TEST_FILE,
+    WAITING_BROADCAST_MESSAGE,
+    WAITING_BROADCAST_SEGMENT,
+    WAITING_BROADCAST_BOOK_CODE
+) = range(7)
+
+# Button labels for the preset broadcast audiences
+SEGMENT_LABELS = {
+    "all": "👥 Hammasi",
+    "active_7": "🔥 Oxirgi 7 kunda faol",
+    "active_30": "📅 Oxirgi 30 kunda faol",
+    "new_7": "🆕 Oxirgi 7 kunda qo'shilgan",
+    "never_downloaded": "😴 Hali kitob olmagan",
+}
 
 db_manager = DatabaseManager()
 
@@ -29,7 +51,8 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("➕ Kitob qo'shish", callback_data="admin_add_book")],
         [InlineKeyboardButton("📋 Kitoblar ro'yxati", callback_data="admin_book_list")],
         [InlineKeyboardButton("📊 Statistika", callback_data="admin_stats")],
-        [InlineKeyboardButton("📤 Xabar yuborish", callback_data="admin_broadcast")]
+        [InlineKeyboardButton("📤 Xabar yuborish", callback_data="admin_broadcast")],
+        [InlineKeyboardButton("🐢 Sekin so'rovlar", callback_data="admin_slow_updates")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -57,9 +80,12 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
     elif query.data == "admin_stats":
         await show_stats(query)
     
+    elif query.data == "admin_slow_updates":
+        await show_slow_updates(query)
+    
     elif query.data == "admin_broadcast":
-        await query.edit_message_text("📝 Barcha foydalanuvchilarga yubormoqchi bo'lgan xabaringizni yozing:")
-        return WAITING_BROADCAST_MESSAGE
+        await show_broadcast_segments(query)
+        return WAITING_BROADCAST_SEGMENT
     
     elif query.data.startswith("delete_book_"):
         book_code = query.data.replace("delete_book_", "")
@@ -102,6 +128,7 @@ async def show_stats(query):
     text = "📊 Bot statistikasi:\n\n"
     text += f"👥 Jami foydalanuvchilar: {stats['total_users']}\n"
     text += f"📚 Faol foydalanuvchilar: {stats['active_users']}\n"
+    text += f"🚫 Botni bloklaganlar: {stats['unreachable_users']}\n"
     text += f"📥 Jami yuklab olingan: {stats['total_downloads']}\n\n"
     
     if stats['popular_books']:
@@ -111,6 +138,29 @@ async def show_stats(query):
     
     await query.edit_message_text(text)
 
+async def show_slow_updates(query):
+    """Show the slowest recent updates with their time breakdown"""
+    entries = await slow_log.worst(10)
+    
+    if not entries:
+        await query.edit_message_text(
+            f"🐢 {slow_log.threshold_ms:.0f} ms dan sekin so'rovlar hozircha yo'q."
+        )
+        return
+    
+    text = "🐢 Eng sekin so'rovlar:\n\n"
+    for entry in entries:
+        text += f"⏱ {entry['total_ms']:.0f} ms - {entry['handler'] or '?'} ({entry['ts']})\n"
+        text += (
+            f"   🗄 DB: {entry['db_ms']:.0f} ms, 💾 Disk: {entry['fs_ms']:.0f} ms, "
+            f"📡 API: {entry['api_ms']:.0f} ms, ⚙️ Boshqa: {entry['other_ms']:.0f} ms\n"
+        )
+        if entry.get('profile'):
+            text += f"   📄 {entry['profile']}\n"
+        text += "\n"
+    
+    await query.edit_message_text(text)
+
 async def delete_book_confirm(query, book_code):
     """Confirm book deletion"""
     keyboard = [
@@ -134,10 +184,8 @@ async def delete_book(query, book_code):
     
     # Delete files
     try:
-        if os.path.exists(book['book_file_path']):
-            os.remove(book['book_file_path'])
-        if os.path.exists(book['test_file_path']):
-            os.remove(book['test_file_path'])
+        await async_files.remove(book['book_file_path'])
+        await async_files.remove(book['test_file_path'])
     except Exception as e:
         print(f"Error deleting files: {e}")
     
@@ -145,6 +193,7 @@ async def delete_book(query, book_code):
     success = await db_manager.delete_book(book_code)
     
     if success:
+        invalidate_search_cache()
         await query.edit_message_text(f"✅ {book_code} kitob muvaffaqiyatli o'chirildi.")
     else:
         await query.edit_message_text("❌ Kitobni o'chirishda xatolik yuz berdi.")
@@ -201,14 +250,15 @@ async def handle_book_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Download file
     book_code = context.user_data['new_book_code']
-    os.makedirs(BOOKS_DIR, exist_ok=True)
+    await async_files.makedirs(BOOKS_DIR)
     
     book_file_path = os.path.join(BOOKS_DIR, f"{book_code}.pdf")
     
     try:
         file = await document.get_file()
-        await file.download_to_drive(book_file_path)
+        await async_files.write_bytes(book_file_path, await file.download_as_bytearray())
         context.user_data['new_book_file_path'] = book_file_path
+        context.user_data['new_book_file_id'] = document.file_id
         
         await update.message.reply_text("✅ Kitob fayli yuklandi.\n\n📎 Endi test faylini yuklang (PDF yoki DOC):")
         return WAITING_TEST_FILE
@@ -246,17 +296,20 @@ async def handle_test_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         file = await document.get_file()
-        await file.download_to_drive(test_file_path)
+        await async_files.write_bytes(test_file_path, await file.download_as_bytearray())
         
         # Save book to database
         success = await db_manager.add_book(
             book_code,
             context.user_data['new_book_title'],
             context.user_data['new_book_file_path'],
-            test_file_path
+            test_file_path,
+            book_file_id=context.user_data.get('new_book_file_id'),
+            test_file_id=document.file_id
         )
         
         if success:
+            invalidate_search_cache()
             await update.message.reply_text(
                 f"✅ {book_code} kitob muvaffaqiyatli qo'shildi!\n\n"
                 f"📖 Nom: {context.user_data['new_book_title']}\n"
@@ -273,6 +326,65 @@ async def handle_test_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Faylni yuklashda xatolik yuz berdi.")
         return WAITING_TEST_FILE
 
+async def show_broadcast_segments(query):
+    """Let the admin pick the broadcast audience, with precomputed sizes"""
+    sizes = await segment_sizes.get(db_manager)
+    
+    keyboard = [
+        [InlineKeyboardButton(f"{label} ({sizes.get(key, 0)})", callback_data=f"segment_{key}")]
+        for key, label in SEGMENT_LABELS.items()
+    ]
+    keyboard.append([InlineKeyboardButton("📖 Kitobni yuklab olganlar", callback_data="segment_book")])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await query.edit_message_text("🎯 Xabar kimlarga yuborilsin?", reply_markup=reply_markup)
+
+async def handle_broadcast_segment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle broadcast audience choice"""
+    query = update.callback_query
+    await query.answer()
+    
+    if not is_admin(query.from_user.id):
+        return ConversationHandler.END
+    
+    key = query.data.replace("segment_", "")
+    
+    if key == "book":
+        await query.edit_message_text("📖 Kitob kodini kiriting:")
+        return WAITING_BROADCAST_BOOK_CODE
+    
+    if key not in PRESET_SEGMENTS:
+        return WAITING_BROADCAST_SEGMENT
+    
+    context.user_data['broadcast_segment'] = PRESET_SEGMENTS[key]
+    sizes = await segment_sizes.get(db_manager)
+    await query.edit_message_text(
+        f"🎯 {SEGMENT_LABELS[key]}: {sizes.get(key, 0)} ta foydalanuvchi\n\n"
+        "📝 Yubormoqchi bo'lgan xabaringizni yozing:"
+    )
+    return WAITING_BROADCAST_MESSAGE
+
+async def handle_broadcast_book_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle book code for a 'downloaded book X' broadcast"""
+    if not is_admin(update.effective_user.id):
+        return ConversationHandler.END
+    
+    book_code = update.message.text.strip().upper()
+    book = await db_manager.get_book(book_code)
+    if not book:
+        await update.message.reply_text(f"❌ {book_code} kodli kitob topilmadi. Qayta kiriting:")
+        return WAITING_BROADCAST_BOOK_CODE
+    
+    segment = {"downloaded_book": book_code}
+    context.user_data['broadcast_segment'] = segment
+    count = await db_manager.count_segment(segment)
+    
+    await update.message.reply_text(
+        f"🎯 {book_code} - {book['title']} kitobini olganlar: {count} ta foydalanuvchi\n\n"
+        "📝 Yubormoqchi bo'lgan xabaringizni yozing:"
+    )
+    return WAITING_BROADCAST_MESSAGE
+
 async def handle_broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle broadcast message"""
     if not is_admin(update.effective_user.id):
@@ -282,29 +394,52 @@ async def handle_broadcast_message(update: Update, context: ContextTypes.DEFAULT
     
     await update.message.reply_text("📤 Xabar yuborilmoqda...")
     
-    # Get all users
-    users = await db_manager.get_all_users()
+    # Send in the background so the bot keeps answering everyone else meanwhile
+    segment = context.user_data.pop('broadcast_segment', {})
+    context.application.create_task(
+        send_broadcast(context, update.effective_chat.id, message, segment),
+        update=update
+    )
+    
+    return ConversationHandler.END
+
+async def send_broadcast(context: ContextTypes.DEFAULT_TYPE, admin_chat_id: int, message: str, segment: dict):
+    """Send a broadcast to the chosen audience and report back to the admin"""
+    users = await db_manager.get_segment_users(segment)
     sent_count = 0
     failed_count = 0
     
     for user_id in users:
+        if not context.application.running:
+            # The bot is shutting down; don't hold up the exit
+            break
         try:
-            await context.bot.send_message(chat_id=user_id, text=message)
+            # Bulk priority: the scheduler paces these behind interactive replies
+            await context.bot.send_message(
+                chat_id=user_id,
+                text=message,
+                rate_limit_args={"priority": Priority.BULK}
+            )
             sent_count += 1
-            await asyncio.sleep(0.1)  # Rate limiting
-        except TelegramError:
+        except TelegramError as e:
             failed_count += 1
+            # Skip users who blocked the bot in future bulk sends
+            reason = unreachable_reason(e)
+            if reason:
+                await reachability.mark_unreachable(user_id, reason)
     
     # Record broadcast
     await db_manager.record_broadcast(message, sent_count)
     
-    await update.message.reply_text(
+    text = (
         f"✅ Xabar yuborish yakunlandi!\n\n"
         f"📤 Yuborildi: {sent_count}\n"
         f"❌ Yuborilmadi: {failed_count}"
     )
-    
-    return ConversationHandler.END
+    skipped = len(users) - sent_count - failed_count
+    if skipped:
+        text += f"\n⏸ Bot to'xtatilgani uchun yuborilmadi: {skipped}"
+    await context.bot.send_message(chat_id=admin_chat_id, text=text)
 
 async def cancel_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel current conversation"""
@@ -0,0 +1,128 @@
+"""
+Async filesystem helpers: blocking file work runs on a bounded thread pool so a
+slow disk never stalls the event loop
+"""
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from config import FILE_IO_WORKERS, FILE_STAT_CACHE_TTL
+from utils.profiler import phase
+
+_executor = ThreadPoolExecutor(max_workers=FILE_IO_WORKERS, thread_name_prefix="file-io")
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking function on the file I/O thread pool"""
+    loop = asyncio.get_running_loop()
+    with phase("fs"):
+        return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+def _stat(path: str) -> Optional[Tuple[int, float]]:
+    """(size, mtime) of a regular file, None if it doesn't exist"""
+    try:
+        result = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return result.st_size, result.st_mtime
+
+class StatCache:
+    """Remembers (size, mtime) of existing files for a short time.
+
+    Once an entry expires the file is stat()ed again; if size or mtime
+    differ from the cached ones, the file was replaced on disk since it was
+    last read, and `replaced()` says so until it is read again. Reads refresh
+    the entry from fstat() of the opened file. A missing file is not
+    remembered: an upload landing right after a miss must be seen at once."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries = {}
+        self._replaced = set()
+
+    async def stat(self, path: str) -> Optional[Tuple[int, float]]:
+        entry = self._entries.get(path)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+
+        result = await run_blocking(_stat, path)
+        if result is None:
+            self.invalidate(path)
+        else:
+            if entry and entry[1] != result:
+                self._replaced.add(path)
+            self._entries[path] = (time.monotonic(), result)
+        return result
+
+    def update(self, path: str, result: Optional[Tuple[int, float]]):
+        """Store the metadata of contents that were just read or written"""
+        self._replaced.discard(path)
+        if result is None:
+            self._entries.pop(path, None)
+        else:
+            self._entries[path] = (time.monotonic(), result)
+
+    def replaced(self, path: str) -> bool:
+        return path in self._replaced
+
+    def invalidate(self, path: str):
+        self._entries.pop(path, None)
+        self._replaced.discard(path)
+
+stat_cache = StatCache(ttl=FILE_STAT_CACHE_TTL)
+
+async def exists(path: str) -> bool:
+    """Check that a file exists, using the stat cache"""
+    return await stat_cache.stat(path) is not None
+
+async def replaced(path: str) -> bool:
+    """Whether a file changed on disk since this process first saw it or
+    last read it, using the stat cache"""
+    await stat_cache.stat(path)
+    return stat_cache.replaced(path)
+
+def _read_bytes(path: str) -> Tuple[bytes, Tuple[int, float]]:
+    with open(path, 'rb') as file:
+        result = os.fstat(file.fileno())
+        return file.read(), (result.st_size, result.st_mtime)
+
+async def read_bytes(path: str) -> bytes:
+    """Read a whole file off the event loop"""
+    try:
+        data, metadata = await run_blocking(_read_bytes, path)
+    except FileNotFoundError:
+        stat_cache.update(path, None)
+        raise
+    stat_cache.update(path, metadata)
+    return data
+
+def _write_bytes(path: str, data: bytes):
+    with open(path, 'wb') as file:
+        file.write(data)
+
+async def write_bytes(path: str, data: bytes):
+    """Write a whole file off the event loop"""
+    try:
+        await run_blocking(_write_bytes, path, data)
+    finally:
+        stat_cache.invalidate(path)
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+async def remove(path: str) -> bool:
+    """Delete a file if it exists. Returns True if something was deleted"""
+    try:
+        return await run_blocking(_remove, path)
+    finally:
+        stat_cache.update(path, None)
+
+async def makedirs(path: str):
+    """os.makedirs(path, exist_ok=True) off the event loop"""
+    await run_blocking(os.makedirs, path, exist_ok=True)
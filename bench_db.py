@@ -0,0 +1,253 @@
+"""
+Micro-benchmarks for DatabaseManager against a large seeded synthetic dataset
+
+Usage:
+    python bench_db.py                      # full size: 1M users, 10M downloads, 10k books
+    python bench_db.py --scale 0.01         # 1% of the full dataset, for quick runs
+    python bench_db.py --output bench.json  # write the JSON report to a file
+
+The report is JSON with ops/s, latency percentiles (ms) and peak RSS (MB)
+for every method, both for sequential calls and for concurrent callers.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from bench_common import peak_rss_mb, percentile
+
+# config prints its banner on import; keep stdout clean for the JSON report
+with contextlib.redirect_stdout(sys.stderr):
+    from database.db_manager import DatabaseManager
+
+FULL_SIZE = {"users": 1_000_000, "downloads": 10_000_000, "books": 10_000}
+WORDS = [
+    "kitob", "tarix", "ilm", "hayot", "dunyo", "sevgi", "yo'l", "inson", "vaqt", "bilim",
+    "harry", "potter", "english", "grammar", "ielts", "python", "data", "science", "atom",
+    "odatlar", "boy", "ota", "kambag'al", "alkimyogar", "jinoyat", "jazo", "urush", "tinchlik"
+]
+INSERT_BATCH = 50_000
+
+def batched(rows, size=INSERT_BATCH):
+    """Yield lists of at most `size` rows"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def book_code(index: int) -> str:
+    return f"BK{index:06d}"
+
+def generate_dataset(db_path: str, users: int, downloads: int, books: int, seed: int):
+    """Fill the schema created by DatabaseManager with seeded synthetic rows"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous = OFF")
+
+    book_downloads = [0] * books
+    user_downloads = [0] * users
+
+    def download_rows():
+        for _ in range(downloads):
+            # Skewed popularity: a few books and users account for most downloads
+            book = min(int(rng.paretovariate(1.2)) - 1, books - 1)
+            user = rng.randrange(users)
+            book_downloads[book] += 1
+            user_downloads[user] += 1
+            yield (user + 1, book_code(book), now - timedelta(seconds=rng.randrange(365 * 86400)))
+
+    for batch in batched(download_rows()):
+        conn.executemany(
+            "INSERT INTO downloads (user_id, book_code, downloaded_at) VALUES (?, ?, ?)", batch
+        )
+
+    book_rows = (
+        (
+            book_code(i),
+            " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))).capitalize(),
+            f"data/books/{book_code(i)}.pdf",
+            f"data/books/{book_code(i)}_test.pdf",
+            book_downloads[i],
+            now - timedelta(seconds=rng.randrange(365 * 86400))
+        )
+        for i in range(books)
+    )
+    for batch in batched(book_rows):
+        conn.executemany("""
+            INSERT INTO books (code, title, book_file_path, test_file_path, download_count, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, batch)
+
+    user_rows = (
+        (
+            i + 1,
+            f"user{i + 1}",
+            rng.choice(WORDS).capitalize(),
+            now - timedelta(seconds=rng.randrange(365 * 86400)),
+            now - timedelta(seconds=rng.randrange(30 * 86400)),
+            user_downloads[i]
+        )
+        for i in range(users)
+    )
+    for batch in batched(user_rows):
+        conn.executemany("""
+            INSERT INTO users (user_id, username, first_name, started_at, last_activity, total_downloads)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, batch)
+
+    conn.commit()
+    conn.close()
+
+def summarize(latencies, wall_time: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": round(len(latencies) / wall_time, 2) if wall_time else None,
+        "latency_ms": {
+            "min": round(latencies[0] * 1000, 3),
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p90": round(percentile(latencies, 90) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3),
+        },
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def build_operations(db: DatabaseManager, sizes: dict, rng: random.Random) -> dict:
+    """Benchmark name -> (zero-argument coroutine factory, relative op count)"""
+    next_user_id = [sizes["users"] + 1]
+
+    def get_book():
+        # One lookup in ten misses, like users mistyping codes
+        index = rng.randrange(int(sizes["books"] * 1.1))
+        return db.get_book(book_code(index))
+
+    def add_user():
+        if rng.random() < 0.5:
+            user_id = next_user_id[0]
+            next_user_id[0] += 1
+        else:
+            user_id = rng.randrange(1, sizes["users"] + 1)
+        return db.add_user(user_id, f"user{user_id}", "Bench", None)
+
+    def record_download():
+        return db.record_download(rng.randrange(1, sizes["users"] + 1), book_code(rng.randrange(sizes["books"])))
+
+    return {
+        "get_book": (get_book, 1.0),
+        "add_user": (add_user, 1.0),
+        "record_download": (record_download, 1.0),
+        "get_stats": (db.get_stats, 0.02),
+        "get_all_books": (db.get_all_books, 0.02),
+        "get_all_users": (db.get_all_users, 0.005),
+    }
+
+async def run_sequential(factory, ops: int) -> dict:
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(ops):
+        op_started = time.perf_counter()
+        await factory()
+        latencies.append(time.perf_counter() - op_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+async def run_concurrent(factory, ops: int, callers: int) -> dict:
+    latencies = []
+    per_caller = max(1, ops // callers)
+
+    async def caller():
+        for _ in range(per_caller):
+            op_started = time.perf_counter()
+            await factory()
+            latencies.append(time.perf_counter() - op_started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(callers)))
+    return summarize(latencies, time.perf_counter() - started)
+
+async def run_benchmarks(args) -> dict:
+    sizes = {name: max(1, int(count * args.scale)) for name, count in FULL_SIZE.items()}
+    for name in FULL_SIZE:
+        if getattr(args, name) is not None:
+            sizes[name] = getattr(args, name)
+
+    db = DatabaseManager()
+    db.db_path = args.db
+
+    generation_time = None
+    if not (args.reuse and os.path.exists(args.db)):
+        if os.path.exists(args.db):
+            os.remove(args.db)
+        await db.init_database()
+        started = time.perf_counter()
+        generate_dataset(args.db, sizes["users"], sizes["downloads"], sizes["books"], args.seed)
+        generation_time = round(time.perf_counter() - started, 2)
+    # Builds indexes (e.g. the search index backfill) over the generated rows
+    await db.init_database()
+
+    rng = random.Random(args.seed)
+    operations = build_operations(db, sizes, rng)
+    selected = args.only.split(",") if args.only else list(operations)
+
+    results = {}
+    for name in selected:
+        factory, weight = operations[name]
+        ops = max(3, int(args.ops * weight))
+        results[name] = {"sequential": await run_sequential(factory, ops)}
+        for callers in args.concurrency:
+            results[name][f"concurrent_{callers}"] = await run_concurrent(factory, ops, callers)
+        print(f"✅ {name} done", file=sys.stderr)
+
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "sqlite": sqlite3.sqlite_version,
+        "seed": args.seed,
+        "dataset": sizes,
+        "database_path": args.db,
+        "database_size_mb": round(os.path.getsize(args.db) / 1024 / 1024, 1),
+        "generation_seconds": generation_time,
+        "benchmarks": results,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark DatabaseManager on synthetic data")
+    parser.add_argument("--scale", type=float, default=1.0, help="fraction of the full dataset size")
+    parser.add_argument("--users", type=int, help="override number of users")
+    parser.add_argument("--downloads", type=int, help="override number of downloads")
+    parser.add_argument("--books", type=int, help="override number of books")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--ops", type=int, default=2000, help="operations per point-query benchmark")
+    parser.add_argument("--concurrency", type=lambda value: [int(v) for v in value.split(",")],
+                        default=[8, 32], help="comma separated concurrent caller counts")
+    parser.add_argument("--only", help="comma separated benchmark names")
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "bench_database.db"))
+    parser.add_argument("--reuse", action="store_true", help="reuse an existing generated database")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run_benchmarks(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -8,44 +8,84 @@ from telegram.ext import ContextTypes
 
 from config import PROMO_CHANNEL
 from database.db_manager import DatabaseManager
+from handlers.inline import invalidate_search_cache
+from utils import async_files
 
 db_manager = DatabaseManager()
 
-async def handle_book_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle book code input from user"""
-    
-    # Check if we're expecting a book code
-    if not context.user_data.get('expecting_book_code'):
+async def book_files_available(book: dict) -> bool:
+    """Check that both files can be delivered, either by file_id or from disk"""
+    return (
+        bool(book['book_file_id'] or await async_files.exists(book['book_file_path'])) and
+        bool(book['test_file_id'] or await async_files.exists(book['test_file_path']))
+    )
+
+async def drop_replaced_file_ids(book: dict):
+    """Forget the file_ids of files replaced on disk, so the new versions
+    are uploaded instead of the old ones Telegram still has"""
+    book_file = bool(book['book_file_id']) and await async_files.replaced(book['book_file_path'])
+    test_file = bool(book['test_file_id']) and await async_files.replaced(book['test_file_path'])
+    if not (book_file or test_file):
         return
     
-    book_code = update.message.text.strip().upper()
+    await db_manager.clear_book_file_ids(book['code'], book_file=book_file, test_file=test_file)
+    invalidate_search_cache()
+    if book_file:
+        book['book_file_id'] = None
+    if test_file:
+        book['test_file_id'] = None
+
+async def send_book_file(message, file_id, path, filename, caption):
+    """Send a file by cached file_id if known, otherwise upload it from disk.
+    Returns the file_id Telegram knows the file by."""
+    if file_id:
+        await message.reply_document(document=file_id, caption=caption)
+        return file_id
+    
+    sent = await message.reply_document(
+        document=await async_files.read_bytes(path),
+        filename=filename,
+        caption=caption
+    )
+    return sent.document.file_id if sent.document else None
+
+async def deliver_book(message, user_id: int, book_code: str, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Send the book and its test file in reply to `message`.
+    Returns True if the book was delivered."""
     
     # Get book from database
     book = await db_manager.get_book(book_code)
+    if book:
+        await drop_replaced_file_ids(book)
     
-    if book and os.path.exists(book['book_file_path']) and os.path.exists(book['test_file_path']):
+    if book and await book_files_available(book):
         try:
             # Send the main book PDF
-            with open(book['book_file_path'], 'rb') as pdf_file:
-                await update.message.reply_document(
-                    document=pdf_file,
-                    filename=f"{book['code']}.pdf",
-                    caption=f"📕 {book['title']}"
-                )
+            book_file_id = await send_book_file(
+                message,
+                file_id=book['book_file_id'],
+                path=book['book_file_path'],
+                filename=f"{book['code']}.pdf",
+                caption=f"📕 {book['title']}"
+            )
             
             # Send the test file
-            with open(book['test_file_path'], 'rb') as test_file:
-                file_extension = os.path.splitext(book['test_file_path'])[1]
-                filename = f"{book['code']}_test{file_extension}"
-                
-                await update.message.reply_document(
-                    document=test_file,
-                    filename=filename,
-                    caption=f"📝 {book['title']} - Test savollari"
-                )
+            file_extension = os.path.splitext(book['test_file_path'])[1]
+            test_file_id = await send_book_file(
+                message,
+                file_id=book['test_file_id'],
+                path=book['test_file_path'],
+                filename=f"{book['code']}_test{file_extension}",
+                caption=f"📝 {book['title']} - Test savollari"
+            )
+            
+            # Remember file_ids of fresh uploads so next time nothing is re-uploaded
+            if book_file_id != book['book_file_id'] or test_file_id != book['test_file_id']:
+                await db_manager.set_book_file_ids(book['code'], book_file_id, test_file_id)
+                invalidate_search_cache()
             
             # Record download
-            await db_manager.record_download(update.effective_user.id, book_code)
+            await db_manager.record_download(user_id, book_code)
             
             # Send final promotional message
             final_message = (
@@ -53,18 +93,30 @@ async def handle_book_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"bizning kanalimizga tashrif buyuring: {PROMO_CHANNEL}"
             )
             
-            await update.message.reply_text(final_message)
+            await message.reply_text(final_message)
             
             # Reset user state
             context.user_data['expecting_book_code'] = False
+            return True
             
         except Exception as e:
-            await update.message.reply_text(
+            await message.reply_text(
                 "❌ Fayllarni yuborishda xatolik yuz berdi. Iltimos, qayta urinib ko'ring."
             )
     else:
         # Invalid book code
-        await update.message.reply_text(
+        await message.reply_text(
             "❌ Noto'g'ri kod kiritildi. Iltimos, kodni tekshirib qayta urinib ko'ring.\n\n"
             "💡 Maslahat: Kod harflari katta bo'lishi kerak (masalan: ABC123)"
-        )
\ No newline at end of file
+        )
+    return False
+
+async def handle_book_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle book code input from user"""
+    
+    # Check if we're expecting a book code
+    if not context.user_data.get('expecting_book_code'):
+        return
+    
+    book_code = update.message.text.strip().upper()
+    await deliver_book(update.message, update.effective_user.id, book_code, context)
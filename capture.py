@@ -0,0 +1,142 @@
+"""
+Opt-in capture of incoming updates for replay. Updates are anonymized (user
+and chat ids replaced by keyed hashes, names dropped), timestamped and
+written as compact JSON lines by a background thread, in segments of
+a fixed number of updates.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from datetime import datetime
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Removed from users and chats
+PERSONAL_FIELDS = ("first_name", "last_name", "username", "title", "bio", "phone_number")
+# Removed wherever they appear
+DROPPED_FIELDS = ("contact", "location", "venue")
+
+def pseudonymize_id(value: int, salt: bytes) -> int:
+    """Stable keyed hash of a user/chat id; the sign is kept so private chats
+    stay positive and groups/channels negative"""
+    digest = hmac.new(salt, str(abs(value)).encode(), hashlib.sha256).digest()
+    pseudonym = int.from_bytes(digest[:6], "big") or 1
+    return pseudonym if value > 0 else -pseudonym
+
+def anonymize(data, salt: bytes):
+    """Copy of an update dict with ids pseudonymized and personal fields removed"""
+    if isinstance(data, list):
+        return [anonymize(item, salt) for item in data]
+    if not isinstance(data, dict):
+        return data
+
+    # Users have is_bot, chats have type; both carry a numeric id
+    is_peer = isinstance(data.get("id"), int) and ("is_bot" in data or "type" in data)
+    result = {}
+    for key, value in data.items():
+        if key in DROPPED_FIELDS or (is_peer and key in PERSONAL_FIELDS):
+            continue
+        if is_peer and key == "id":
+            result[key] = pseudonymize_id(value, salt)
+        else:
+            result[key] = anonymize(value, salt)
+    if is_peer and "is_bot" in data:
+        # Required by User.de_json
+        result["first_name"] = "User"
+    return result
+
+class UpdateRecorder:
+    """Writes `updates-<timestamp>.jsonl` segments of {"t": unix time, "update": {...}}"""
+
+    def __init__(self, capture_dir: str, salt: str = "", segment_size: int = 50000,
+                 queue_size: int = 10000):
+        self.capture_dir = capture_dir
+        # Without a fixed salt, ids can't be linked across captures
+        self.salt = (salt or secrets.token_hex(16)).encode()
+        self.segment_size = segment_size
+        self.recorded = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._write_loop, name="update-capture", daemon=True)
+        self._thread.start()
+
+    def record(self, update: Update):
+        """Queue an update for writing; never blocks the event loop"""
+        try:
+            self._queue.put_nowait((time.time(), update.to_dict()))
+        except queue.Full:
+            self.dropped += 1
+
+    def _open_segment(self):
+        os.makedirs(self.capture_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        path = os.path.join(self.capture_dir, f"updates-{stamp}.jsonl")
+        logger.info(f"📼 Capturing updates to {path}")
+        return open(path, "a", encoding="utf-8")
+
+    def _write_loop(self):
+        file = None
+        in_segment = 0
+        while True:
+            try:
+                item = self._queue.get(timeout=1)
+            except queue.Empty:
+                # Quiet period: make what was captured so far readable
+                if file:
+                    file.flush()
+                continue
+            if item is None:
+                break
+
+            timestamp, data = item
+            try:
+                if file is None or in_segment >= self.segment_size:
+                    if file:
+                        file.close()
+                    file = self._open_segment()
+                    in_segment = 0
+                line = json.dumps(
+                    {"t": round(timestamp, 3), "update": anonymize(data, self.salt)},
+                    ensure_ascii=False,
+                    separators=(",", ":")
+                )
+                file.write(line + "\n")
+                in_segment += 1
+                self.recorded += 1
+            except Exception as e:
+                logger.error(f"Failed to capture update: {e}")
+
+        if file:
+            file.close()
+
+    def _close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    async def close(self):
+        """Write out everything queued and close the segment (a flush hook)"""
+        await asyncio.get_running_loop().run_in_executor(None, self._close)
+        logger.info(f"📼 Captured {self.recorded} updates ({self.dropped} dropped)")
+
+class RecordingQueue(asyncio.Queue):
+    """Update queue that hands every incoming update to the recorder, so
+    timestamps reflect arrival rather than processing time"""
+
+    def __init__(self, recorder: UpdateRecorder, maxsize: int = 0):
+        super().__init__(maxsize)
+        self.recorder = recorder
+
+    def put_nowait(self, item):
+        # asyncio.Queue.put() ends in put_nowait(), so this sees every update
+        if isinstance(item, Update):
+            self.recorder.record(item)
+        super().put_nowait(item)
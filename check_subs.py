@@ -5,6 +5,12 @@ Utility functions for checking user subscriptions
 from telegram import Bot
 from telegram.error import BadRequest, Forbidden
 
+from config import SUBSCRIPTION_CACHE_TTL
+from utils.cache import TTLCache
+
+# Only positive results are cached so a freshly subscribed user is never told "no"
+_subscription_cache = TTLCache(ttl=SUBSCRIPTION_CACHE_TTL, maxsize=50000)
+
 async def check_user_subscriptions(bot: Bot, user_id: int, channel_ids: list) -> bool:
     """
     Check if user is subscribed to all required channels
@@ -18,6 +24,10 @@ async def check_user_subscriptions(bot: Bot, user_id: int, channel_ids: list) ->
         bool: True if subscribed to all channels, False otherwise
     """
     
+    cache_key = (user_id, tuple(channel_ids))
+    if _subscription_cache.get(cache_key):
+        return True
+    
     for channel_id in channel_ids:
         try:
             # Get chat member info
@@ -36,6 +46,7 @@ async def check_user_subscriptions(bot: Bot, user_id: int, channel_ids: list) ->
             return False
     
     # If we get here, user is subscribed to all channels
+    _subscription_cache.set(cache_key, True)
     return True
 
 async def check_single_subscription(bot: Bot, user_id: int, channel_id: str) -> bool:
@@ -48,15 +48,88 @@ BOOKS_DIR = os.getenv("BOOKS_DIR", "data/books")
 # Logging configuration
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 LOG_FILE = os.getenv("LOG_FILE", "logs/bot.log")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))  # share of per-update info logs kept
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Slow update profiling
+SLOW_UPDATE_THRESHOLD_MS = float(os.getenv("SLOW_UPDATE_THRESHOLD_MS", "1000"))
+SLOW_LOG_FILE = os.getenv("SLOW_LOG_FILE", "logs/slow_updates.log")
+SLOW_LOG_SIZE = int(os.getenv("SLOW_LOG_SIZE", "200"))  # slow updates kept in memory for /admin
+SLOW_PROFILE_SAMPLE_RATE = float(os.getenv("SLOW_PROFILE_SAMPLE_RATE", "0"))  # share of updates run under cProfile
+PROFILE_DIR = os.getenv("PROFILE_DIR", "logs/profiles")
 
 # Security settings
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "52428800"))  # 50MB
 RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
 
-# Create directories if they don't exist
-os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
-os.makedirs(BOOKS_DIR, exist_ok=True)
-os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+# Outgoing Bot API request scheduling
+API_RATE_LIMIT = float(os.getenv("API_RATE_LIMIT", "30"))  # requests per second, whole bot
+API_CHAT_RATE_LIMIT = float(os.getenv("API_CHAT_RATE_LIMIT", "1"))  # messages per second, private chat
+API_CHAT_BURST = int(os.getenv("API_CHAT_BURST", "3"))  # messages a chat may receive back to back
+API_GROUP_RATE_LIMIT = float(os.getenv("API_GROUP_RATE_LIMIT", "20"))  # messages per minute, group/channel
+API_MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "3"))
+
+# HTTP connection pools for the Bot API client (timeouts in seconds)
+HTTP_UPLOAD_POOL_SIZE = int(os.getenv("HTTP_UPLOAD_POOL_SIZE", "4"))
+HTTP_UPLOAD_TIMEOUT = float(os.getenv("HTTP_UPLOAD_TIMEOUT", "120"))
+HTTP_INTERACTIVE_POOL_SIZE = int(os.getenv("HTTP_INTERACTIVE_POOL_SIZE", "16"))
+HTTP_INTERACTIVE_TIMEOUT = float(os.getenv("HTTP_INTERACTIVE_TIMEOUT", "10"))
+HTTP_UPDATES_TIMEOUT = float(os.getenv("HTTP_UPDATES_TIMEOUT", "30"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+
+# Deploy behaviour: how long shutdown waits for in-flight updates, and how
+# many users' pending updates are processed in parallel on startup
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "8"))  # seconds
+BACKLOG_CONCURRENCY = int(os.getenv("BACKLOG_CONCURRENCY", "32"))
+# Updates received but not handled yet, kept across restarts
+UPDATE_JOURNAL_PATH = os.getenv("UPDATE_JOURNAL_PATH", "data/update_journal.db")
+
+# Updates handled at the same time; each user's updates still run one by one
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))
+
+# Multi-process mode: with WORKER_PROCESSES > 1 a front process receives updates
+# and hands them to that many worker processes, each user always to the same one
+# Each worker may use API_RATE_LIMIT / WORKER_PROCESSES, broadcasts included, so a
+# broadcast (sent from one worker) goes out that many times slower
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "5"))  # seconds
+# Receive updates by webhook instead of polling (multi-process mode only)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Opt-in capture of incoming updates for the replay tool; empty dir disables it
+UPDATE_CAPTURE_DIR = os.getenv("UPDATE_CAPTURE_DIR", "")
+UPDATE_CAPTURE_SALT = os.getenv("UPDATE_CAPTURE_SALT", "")  # key for hashing user ids, random if empty
+UPDATE_CAPTURE_SEGMENT_SIZE = int(os.getenv("UPDATE_CAPTURE_SEGMENT_SIZE", "50000"))  # updates per file
+
+# Online database backups: compressed snapshots, newest BACKUP_KEEP kept
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", "21600"))  # seconds, 0 disables backups
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "1024"))  # pages copied per step
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.05"))  # seconds writers get between steps
+
+# How often broadcast audience sizes are recomputed
+SEGMENT_REFRESH_INTERVAL = int(os.getenv("SEGMENT_REFRESH_INTERVAL", "300"))  # seconds
+
+# Inline search settings
+INLINE_CACHE_TTL = int(os.getenv("INLINE_CACHE_TTL", "30"))  # seconds
+INLINE_RESULTS_LIMIT = int(os.getenv("INLINE_RESULTS_LIMIT", "20"))  # Telegram allows up to 50
+
+# How long a successful subscription check is trusted
+SUBSCRIPTION_CACHE_TTL = int(os.getenv("SUBSCRIPTION_CACHE_TTL", "300"))  # seconds
+
+# Blocking file work (book delivery, deletion) runs on this many threads
+FILE_IO_WORKERS = int(os.getenv("FILE_IO_WORKERS", "4"))
+FILE_STAT_CACHE_TTL = float(os.getenv("FILE_STAT_CACHE_TTL", "60"))  # seconds
+
+def ensure_directories():
+    """Create data and log directories if they don't exist"""
+    os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
+    os.makedirs(BOOKS_DIR, exist_ok=True)
+    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
 
 # Bot info for logging
 print(f"🤖 Bot configured: @{BOT_USERNAME}")
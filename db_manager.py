@@ -3,19 +3,43 @@ Database manager for the Telegram bot
 """
 import aiosqlite
 import os
+import re
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 from config import DATABASE_PATH
+from database.segments import build_segment_filter
+from utils.profiler import phase
+
+# Column weights for bm25() ranking: (code, title)
+SEARCH_RANK_WEIGHTS = (10.0, 1.0)
+
+def build_fts_query(text: str) -> Optional[str]:
+    """Turn free user input into a safe FTS5 prefix query"""
+    tokens = re.findall(r"\w+", text.lower())
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens[:8])
 
 class DatabaseManager:
     def __init__(self):
         self.db_path = DATABASE_PATH
         
+    @asynccontextmanager
+    async def _connect(self):
+        """Open a connection; time spent is attributed to the update's DB phase"""
+        with phase("db"):
+            async with aiosqlite.connect(self.db_path) as db:
+                yield db
+    
     async def init_database(self):
         """Initialize database tables"""
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
+            # WAL lets online backups and readers run alongside writes
+            await db.execute("PRAGMA journal_mode=WAL")
+            
             # Books table
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS books (
@@ -25,9 +49,28 @@ class DatabaseManager:
                     book_file_path TEXT NOT NULL,
                     test_file_path TEXT NOT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    download_count INTEGER DEFAULT 0
+                    download_count INTEGER DEFAULT 0,
+                    book_file_id TEXT,
+                    test_file_id TEXT
+                )
+            """)
+            await self._ensure_column(db, "books", "book_file_id", "TEXT")
+            await self._ensure_column(db, "books", "test_file_id", "TEXT")
+            
+            # Full-text index over book codes and titles, rowid mirrors books.id
+            await db.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+                    code,
+                    title,
+                    tokenize = 'unicode61 remove_diacritics 2',
+                    prefix = '1 2 3'
                 )
             """)
+            await db.execute("""
+                INSERT INTO books_fts (rowid, code, title)
+                SELECT id, code, title FROM books
+                WHERE id NOT IN (SELECT rowid FROM books_fts)
+            """)
             
             # Users table
             await db.execute("""
@@ -38,9 +81,15 @@ class DatabaseManager:
                     last_name TEXT,
                     started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    total_downloads INTEGER DEFAULT 0
+                    total_downloads INTEGER DEFAULT 0,
+                    is_reachable INTEGER DEFAULT 1,
+                    unreachable_at TIMESTAMP,
+                    unreachable_reason TEXT
                 )
             """)
+            await self._ensure_column(db, "users", "is_reachable", "INTEGER DEFAULT 1")
+            await self._ensure_column(db, "users", "unreachable_at", "TIMESTAMP")
+            await self._ensure_column(db, "users", "unreachable_reason", "TEXT")
             
             # Downloads table
             await db.execute("""
@@ -54,6 +103,14 @@ class DatabaseManager:
                 )
             """)
             
+            # Indexes for audience segments
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_users_last_activity ON users (last_activity)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_users_started_at ON users (started_at)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_users_total_downloads ON users (total_downloads)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_downloads_book_user ON downloads (book_code, user_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_downloads_user ON downloads (user_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_users_reachable ON users (is_reachable)")
+            
             # Broadcast messages table
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS broadcasts (
@@ -66,23 +123,43 @@ class DatabaseManager:
             
             await db.commit()
     
+    async def _ensure_column(self, db, table: str, column: str, definition: str):
+        """Add a column to an existing table created by an older version"""
+        async with db.execute(f"PRAGMA table_info({table})") as cursor:
+            columns = [row[1] for row in await cursor.fetchall()]
+        if column not in columns:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    
     async def add_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None):
         """Add or update user in database"""
-        async with aiosqlite.connect(self.db_path) as db:
+        # started_at is set here rather than by its UTC column default, so it
+        # uses the same local clock as last_activity and the segment filters
+        now = datetime.now()
+        async with self._connect() as db:
             await db.execute("""
-                INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, last_activity)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, username, first_name, last_name, datetime.now()))
+                INSERT INTO users (user_id, username, first_name, last_name, started_at, last_activity)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name,
+                    last_activity = excluded.last_activity
+            """, (user_id, username, first_name, last_name, now, now))
             await db.commit()
     
-    async def add_book(self, code: str, title: str, book_file_path: str, test_file_path: str) -> bool:
+    async def add_book(self, code: str, title: str, book_file_path: str, test_file_path: str,
+                       book_file_id: str = None, test_file_id: str = None) -> bool:
         """Add a new book to database"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._connect() as db:
+                cursor = await db.execute("""
+                    INSERT INTO books (code, title, book_file_path, test_file_path, book_file_id, test_file_id)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (code.upper(), title, book_file_path, test_file_path, book_file_id, test_file_id))
                 await db.execute("""
-                    INSERT INTO books (code, title, book_file_path, test_file_path)
-                    VALUES (?, ?, ?, ?)
-                """, (code.upper(), title, book_file_path, test_file_path))
+                    INSERT INTO books_fts (rowid, code, title)
+                    VALUES (?, ?, ?)
+                """, (cursor.lastrowid, code.upper(), title))
                 await db.commit()
                 return True
         except aiosqlite.IntegrityError:
@@ -90,9 +167,10 @@ class DatabaseManager:
     
     async def get_book(self, code: str) -> Optional[Dict]:
         """Get book by code"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute("""
-                SELECT code, title, book_file_path, test_file_path, download_count
+                SELECT code, title, book_file_path, test_file_path, download_count,
+                       book_file_id, test_file_id
                 FROM books WHERE code = ?
             """, (code.upper(),)) as cursor:
                 row = await cursor.fetchone()
@@ -102,13 +180,64 @@ class DatabaseManager:
                         'title': row[1],
                         'book_file_path': row[2],
                         'test_file_path': row[3],
-                        'download_count': row[4]
+                        'download_count': row[4],
+                        'book_file_id': row[5],
+                        'test_file_id': row[6]
                     }
                 return None
     
+    async def set_book_file_ids(self, code: str, book_file_id: str = None, test_file_id: str = None):
+        """Remember Telegram file_ids so the files can be re-sent without uploading"""
+        async with self._connect() as db:
+            await db.execute("""
+                UPDATE books
+                SET book_file_id = COALESCE(?, book_file_id),
+                    test_file_id = COALESCE(?, test_file_id)
+                WHERE code = ?
+            """, (book_file_id, test_file_id, code.upper()))
+            await db.commit()
+    
+    async def clear_book_file_ids(self, code: str, book_file: bool = False, test_file: bool = False):
+        """Forget Telegram file_ids, so the files are uploaded from disk again"""
+        async with self._connect() as db:
+            await db.execute("""
+                UPDATE books
+                SET book_file_id = CASE WHEN ? THEN NULL ELSE book_file_id END,
+                    test_file_id = CASE WHEN ? THEN NULL ELSE test_file_id END
+                WHERE code = ?
+            """, (book_file, test_file, code.upper()))
+            await db.commit()
+    
+    async def search_books(self, text: str, limit: int = 20) -> List[Dict]:
+        """Full-text search over book codes and titles, best matches first"""
+        match = build_fts_query(text)
+        if not match:
+            return []
+        
+        async with self._connect() as db:
+            async with db.execute("""
+                SELECT b.code, b.title, b.download_count, b.book_file_id, b.test_file_id
+                FROM books_fts f
+                JOIN books b ON b.id = f.rowid
+                WHERE books_fts MATCH ?
+                ORDER BY bm25(books_fts, ?, ?), b.download_count DESC
+                LIMIT ?
+            """, (match, *SEARCH_RANK_WEIGHTS, limit)) as cursor:
+                rows = await cursor.fetchall()
+                return [
+                    {
+                        'code': row[0],
+                        'title': row[1],
+                        'download_count': row[2],
+                        'book_file_id': row[3],
+                        'test_file_id': row[4]
+                    }
+                    for row in rows
+                ]
+    
     async def get_all_books(self) -> List[Dict]:
         """Get all books"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute("""
                 SELECT code, title, download_count, created_at
                 FROM books ORDER BY created_at DESC
@@ -126,14 +255,18 @@ class DatabaseManager:
     
     async def delete_book(self, code: str) -> bool:
         """Delete book by code"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
+            await db.execute("""
+                DELETE FROM books_fts
+                WHERE rowid IN (SELECT id FROM books WHERE code = ?)
+            """, (code.upper(),))
             cursor = await db.execute("DELETE FROM books WHERE code = ?", (code.upper(),))
             await db.commit()
             return cursor.rowcount > 0
     
     async def record_download(self, user_id: int, book_code: str):
         """Record a book download"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             # Record download
             await db.execute("""
                 INSERT INTO downloads (user_id, book_code)
@@ -156,15 +289,21 @@ class DatabaseManager:
     
     async def get_stats(self) -> Dict:
         """Get bot statistics"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Total users
-            async with db.execute("SELECT COUNT(*) FROM users") as cursor:
+        async with self._connect() as db:
+            # Total users (who haven't blocked the bot)
+            async with db.execute("SELECT COUNT(*) FROM users WHERE is_reachable = 1") as cursor:
                 total_users = (await cursor.fetchone())[0]
             
             # Users with downloads
-            async with db.execute("SELECT COUNT(*) FROM users WHERE total_downloads > 0") as cursor:
+            async with db.execute("""
+                SELECT COUNT(*) FROM users WHERE total_downloads > 0 AND is_reachable = 1
+            """) as cursor:
                 active_users = (await cursor.fetchone())[0]
             
+            # Users who blocked the bot or deleted their account
+            async with db.execute("SELECT COUNT(*) FROM users WHERE is_reachable = 0") as cursor:
+                unreachable_users = (await cursor.fetchone())[0]
+            
             # Total downloads
             async with db.execute("SELECT COUNT(*) FROM downloads") as cursor:
                 total_downloads = (await cursor.fetchone())[0]
@@ -181,20 +320,64 @@ class DatabaseManager:
             return {
                 'total_users': total_users,
                 'active_users': active_users,
+                'unreachable_users': unreachable_users,
                 'total_downloads': total_downloads,
                 'popular_books': popular_books
             }
     
-    async def get_all_users(self) -> List[int]:
+    async def get_all_users(self, include_unreachable: bool = False) -> List[int]:
         """Get all user IDs for broadcasting"""
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT user_id FROM users") as cursor:
+        query = "SELECT user_id FROM users"
+        if not include_unreachable:
+            query += " WHERE is_reachable = 1"
+        async with self._connect() as db:
+            async with db.execute(query) as cursor:
+                rows = await cursor.fetchall()
+                return [row[0] for row in rows]
+    
+    async def mark_unreachable(self, user_id: int, reason: str):
+        """Remember that messages to this user fail (bot blocked, account deleted)"""
+        async with self._connect() as db:
+            await db.execute("""
+                UPDATE users SET is_reachable = 0, unreachable_at = ?, unreachable_reason = ?
+                WHERE user_id = ?
+            """, (datetime.now(), reason, user_id))
+            await db.commit()
+    
+    async def mark_reachable(self, user_id: int):
+        """Re-activate a user who talks to the bot again"""
+        async with self._connect() as db:
+            await db.execute("""
+                UPDATE users SET is_reachable = 1, unreachable_at = NULL, unreachable_reason = NULL
+                WHERE user_id = ?
+            """, (user_id,))
+            await db.commit()
+    
+    async def get_unreachable_users(self) -> List[int]:
+        """Get IDs of all users marked unreachable"""
+        async with self._connect() as db:
+            async with db.execute("SELECT user_id FROM users WHERE is_reachable = 0") as cursor:
+                rows = await cursor.fetchall()
+                return [row[0] for row in rows]
+    
+    async def count_segment(self, segment: Dict) -> int:
+        """Count users in an audience segment"""
+        where, params = build_segment_filter(segment)
+        async with self._connect() as db:
+            async with db.execute(f"SELECT COUNT(*) FROM users u WHERE {where}", params) as cursor:
+                return (await cursor.fetchone())[0]
+    
+    async def get_segment_users(self, segment: Dict) -> List[int]:
+        """Get user IDs in an audience segment for targeted broadcasting"""
+        where, params = build_segment_filter(segment)
+        async with self._connect() as db:
+            async with db.execute(f"SELECT u.user_id FROM users u WHERE {where}", params) as cursor:
                 rows = await cursor.fetchall()
                 return [row[0] for row in rows]
     
     async def record_broadcast(self, message: str, sent_count: int):
         """Record broadcast message"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("""
                 INSERT INTO broadcasts (message, sent_count)
                 VALUES (?, ?)
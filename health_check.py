@@ -7,6 +7,14 @@ from http.server import HTTPServer, BaseHTTPRequestHandler
 import threading
 import json
 
+# Optional callable returning extra status, e.g. the worker pool's health
+status_provider = None
+
+def set_status_provider(provider):
+    """Include `provider()` in health responses; a "status" of "unhealthy" fails the check"""
+    global status_provider
+    status_provider = provider
+
 class HealthHandler(BaseHTTPRequestHandler):
     def do_GET(self):
         if self.path == '/health':
@@ -24,8 +32,16 @@ class HealthHandler(BaseHTTPRequestHandler):
                     "timestamp": str(os.times()),
                     "bot": "running"
                 }
+                code = 200
+                
+                if status_provider is not None:
+                    extra = status_provider()
+                    status["workers"] = extra
+                    if extra.get("status") == "unhealthy":
+                        status["status"] = "unhealthy"
+                        code = 503
                 
-                self.send_response(200)
+                self.send_response(code)
                 self.send_header('Content-type', 'application/json')
                 self.end_headers()
                 self.wfile.write(json.dumps(status).encode())
@@ -0,0 +1,110 @@
+"""
+Inline mode handler: search books by title or code from any chat
+"""
+
+import re
+from telegram import (
+    Update,
+    InlineQueryResultArticle,
+    InlineQueryResultCachedDocument,
+    InlineQueryResultsButton,
+    InputTextMessageContent
+)
+from telegram.ext import ContextTypes
+
+from config import CHANNEL_IDS, INLINE_CACHE_TTL, INLINE_RESULTS_LIMIT
+from utils.cache import TTLCache
+from utils.check_subs import check_user_subscriptions
+from database.db_manager import DatabaseManager
+
+db_manager = DatabaseManager()
+
+# Search results keyed by normalized query text
+search_cache = TTLCache(ttl=INLINE_CACHE_TTL, maxsize=4096)
+
+# Characters Telegram accepts in a /start deep-link parameter
+START_PARAMETER_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Deep-link payload used when a book code can't be passed through /start
+INLINE_START_PARAMETER = "inline"
+
+# Result id prefix of results that send the book file itself
+FILE_RESULT_PREFIX = "file:"
+
+def invalidate_search_cache():
+    """Forget cached search results after the catalog changes"""
+    search_cache.clear()
+
+async def search_books_cached(text: str):
+    """Run a catalog search, reusing results for recently seen queries"""
+    key = " ".join(text.lower().split())
+    books = search_cache.get(key)
+    if books is None:
+        books = await db_manager.search_books(key, limit=INLINE_RESULTS_LIMIT)
+        search_cache.set(key, books)
+    return books
+
+def build_result(book: dict, deliver_file: bool):
+    """Build a single inline result for a book"""
+    if deliver_file and book['book_file_id']:
+        return InlineQueryResultCachedDocument(
+            id=f"{FILE_RESULT_PREFIX}{book['code']}",
+            title=f"📕 {book['title']}",
+            document_file_id=book['book_file_id'],
+            description=f"Kod: {book['code']}",
+            caption=f"📕 {book['title']}"
+        )
+
+    return InlineQueryResultArticle(
+        id=book['code'],
+        title=f"📕 {book['title']}",
+        description=f"Kod: {book['code']}",
+        input_message_content=InputTextMessageContent(
+            f"📕 {book['title']}\n🔑 Kod: {book['code']}"
+        )
+    )
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer inline queries with ranked book matches"""
+    query = update.inline_query
+    text = query.query.strip()
+
+    # Single characters match most of the catalog and are not worth ranking
+    if len(text) < 2:
+        await query.answer([], cache_time=INLINE_CACHE_TTL, is_personal=True)
+        return
+
+    books = await search_books_cached(text)
+
+    # Files are only handed out to users who passed the subscription check
+    is_subscribed = bool(books) and await check_user_subscriptions(
+        context.bot, query.from_user.id, list(CHANNEL_IDS.values())
+    )
+
+    button = None
+    if books and not is_subscribed:
+        start_parameter = books[0]['code']
+        if not START_PARAMETER_PATTERN.match(start_parameter):
+            start_parameter = INLINE_START_PARAMETER
+        button = InlineQueryResultsButton(
+            text="📢 Kitob olish uchun obuna bo'ling",
+            start_parameter=start_parameter
+        )
+
+    results = [build_result(book, is_subscribed) for book in books]
+    await query.answer(
+        results,
+        cache_time=INLINE_CACHE_TTL,
+        is_personal=True,
+        button=button
+    )
+
+async def inline_result_chosen(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Count a book sent through an inline result as a download.
+
+    Telegram only reports chosen results with inline feedback enabled in
+    @BotFather (/setinlinefeedback, 100% to count every one)."""
+    result = update.chosen_inline_result
+    if result.result_id.startswith(FILE_RESULT_PREFIX):
+        book_code = result.result_id[len(FILE_RESULT_PREFIX):]
+        await db_manager.record_download(result.from_user.id, book_code)
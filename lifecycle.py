@@ -0,0 +1,477 @@
+"""
+Application lifecycle: fast catch-up on pending updates at startup and a
+graceful drain on shutdown, so deploys don't lose user messages
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import sqlite3
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# The journal's connection is only ever used from this one thread
+_journal_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="update-journal")
+
+def update_fingerprint(update: Update):
+    """What makes two updates from the same user interchangeable"""
+    if update.message and update.message.text:
+        return ("message", update.message.text.strip())
+    if update.callback_query:
+        return ("callback_query", update.callback_query.data)
+    if update.inline_query:
+        return ("inline_query", update.inline_query.query)
+    return None
+
+def collapse_updates(updates):
+    """Group pending updates per user, dropping consecutive duplicates
+    (button mashing, re-sent codes). Order within each user is kept."""
+    per_user = defaultdict(list)
+    for update in updates:
+        user = update.effective_user
+        key = user.id if user else ("update", update.update_id)
+        queue = per_user[key]
+        fingerprint = update_fingerprint(update)
+        if fingerprint is not None and queue and update_fingerprint(queue[-1]) == fingerprint:
+            # Keep the newest copy, e.g. the freshest callback query to answer
+            queue[-1] = update
+        else:
+            queue.append(update)
+    return list(per_user.values())
+
+MAX_FETCH_BACKOFF = 30
+
+async def fetch_updates(bot, offset, limit: int, timeout: int, allowed_updates, stopping=None):
+    """getUpdates, retried with backoff until it succeeds; empty once
+    `stopping()` is true"""
+    backoff = 1
+    while not (stopping and stopping()):
+        try:
+            return await bot.get_updates(
+                offset=offset,
+                limit=limit,
+                timeout=timeout,
+                allowed_updates=allowed_updates
+            )
+        except TelegramError as e:
+            logger.warning(f"Fetching updates failed: {e}, retrying in {backoff}s")
+            await asyncio.sleep(backoff)
+            backoff = min(MAX_FETCH_BACKOFF, backoff * 2)
+    return ()
+
+class Backlog:
+    """Updates that queued up while the bot was down, fetched page by page.
+
+    Each page is acknowledged only by the next getUpdates call, i.e. once the
+    consumer asks for more. Updates with ids up to `seen` are skipped."""
+
+    def __init__(self, fetch, seen: int = 0):
+        # fetch(offset) -> a page of updates, empty when there are no more
+        self.fetch = fetch
+        self.seen = seen
+        self.next_offset = None
+        self.total = 0
+        self.kept = 0
+
+    async def batches(self):
+        """Yield each page as per-user lists, duplicates collapsed"""
+        while True:
+            updates = await self.fetch(self.next_offset)
+            if not updates:
+                return
+
+            self.next_offset = updates[-1].update_id + 1
+            updates = [update for update in updates if update.update_id > self.seen]
+            per_user = collapse_updates(updates)
+            self.total += len(updates)
+            self.kept += sum(len(user_updates) for user_updates in per_user)
+            yield per_user
+
+    def log_summary(self):
+        if self.total:
+            logger.info(
+                f"📬 Caught up on {self.total} pending updates "
+                f"({self.total - self.kept} duplicates collapsed)"
+            )
+
+def install_stop_handlers(callback):
+    """Call `callback` on SIGINT and SIGTERM"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, callback)
+        except (NotImplementedError, RuntimeError):
+            # Not supported on Windows event loops
+            pass
+
+class SkippedUpdate(Exception):
+    """An update was dropped before its handlers started"""
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Handles up to `max_concurrent_updates` updates at once, but one user's
+    updates strictly one after another and in order of arrival"""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # user id -> [lock, number of updates holding or waiting for it]
+        self._user_locks = {}
+        self._done_callbacks = []
+        self._waiting = 0
+        self._skip_waiting = False
+
+    def add_done_callback(self, callback):
+        """Call `callback(update)` after every handled update"""
+        self._done_callbacks.append(callback)
+
+    def skip_waiting(self) -> int:
+        """Drop updates whose handlers haven't started yet, now and from now
+        on; returns how many were waiting"""
+        self._skip_waiting = True
+        return self._waiting
+
+    async def initialize(self):
+        """Nothing to set up"""
+
+    async def shutdown(self):
+        """Nothing to clean up"""
+
+    async def process_update(self, update, coroutine):
+        self._waiting += 1
+        try:
+            user = update.effective_user if isinstance(update, Update) else None
+            if user is None:
+                await super().process_update(update, coroutine)
+            else:
+                await self._process_user_update(user.id, update, coroutine)
+        except SkippedUpdate:
+            return
+        for callback in self._done_callbacks:
+            callback(update)
+
+    async def _process_user_update(self, user_id, update, coroutine):
+        # Wait for the user's turn before taking a slot, so one user's burst
+        # can't occupy every slot while its updates wait on each other
+        entry = self._user_locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._user_locks[user_id]
+
+    async def do_process_update(self, update, coroutine):
+        self._waiting -= 1
+        if self._skip_waiting:
+            coroutine.close()
+            raise SkippedUpdate()
+        await coroutine
+
+class UpdateJournal:
+    """Updates fetched from Telegram but not handled yet, kept in a small
+    SQLite file so they survive a restart after Telegram has forgotten them"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(_journal_executor, func, *args)
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS pending_updates (
+                update_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL
+            )
+        """)
+        self._db.commit()
+        rows = self._db.execute("SELECT data FROM pending_updates ORDER BY update_id")
+        return [json.loads(data) for data, in rows]
+
+    def _add(self, rows):
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO pending_updates (update_id, data) VALUES (?, ?)", rows
+            )
+
+    def _remove(self, update_ids):
+        with self._db:
+            self._db.executemany(
+                "DELETE FROM pending_updates WHERE update_id = ?",
+                [(update_id,) for update_id in update_ids]
+            )
+
+    async def open(self):
+        """Open the journal; returns the update dicts left over from the last run"""
+        return await self._run(self._open)
+
+    async def add(self, updates):
+        rows = [
+            (update.update_id, json.dumps(update.to_dict(), ensure_ascii=False))
+            for update in updates
+        ]
+        await self._run(self._add, rows)
+
+    async def remove(self, update_ids):
+        await self._run(self._remove, update_ids)
+
+    async def close(self):
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+
+class LifecycleManager:
+    """Runs polling for an Application with backlog catch-up and graceful drain.
+
+    Polled updates are confirmed to Telegram as soon as they are fetched, so
+    intake never waits for slow handlers. With a `journal` they are written
+    to it first and removed once handled; whatever is still unhandled when the
+    process stops, even if it is killed, is handled on the next start. The
+    application must use a PerUserUpdateProcessor."""
+
+    def __init__(self, app, allowed_updates, drain_timeout: float = 8,
+                 backlog_concurrency: int = 32, backlog_batch_size: int = 100,
+                 poll_timeout: int = 10, journal: Optional[UpdateJournal] = None):
+        self.app = app
+        self.allowed_updates = allowed_updates
+        self.drain_timeout = drain_timeout
+        self.backlog_concurrency = backlog_concurrency
+        self.backlog_batch_size = backlog_batch_size
+        self.poll_timeout = poll_timeout
+        self.journal = journal
+        self._polling = False
+        self._next_offset = None
+        # Ids of handled updates still to be removed from the journal
+        self._handled = []
+        self._forget_task = None
+        self._flush_hooks = []
+        self._background = []
+        self._background_tasks = []
+        self._stop_event = None
+
+    def add_flush_hook(self, hook):
+        """Register a coroutine function to run after handlers have drained,
+        e.g. to flush buffered writes"""
+        self._flush_hooks.append(hook)
+
+    def add_background_task(self, coroutine_function):
+        """Register a coroutine function to run while the bot is up; it is
+        cancelled on shutdown"""
+        self._background.append(coroutine_function)
+
+    async def _cancel_background_tasks(self):
+        for task in self._background_tasks:
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        self._background_tasks = []
+
+    def request_stop(self):
+        """Begin graceful shutdown (safe to call from signal handlers)"""
+        if self._stop_event is not None:
+            self._stop_event.set()
+
+    def _stopping(self) -> bool:
+        return self._stop_event is not None and self._stop_event.is_set()
+
+    async def _get_updates(self, offset, timeout: int):
+        return await fetch_updates(
+            self.app.bot, offset, self.backlog_batch_size, timeout, self.allowed_updates,
+            stopping=self._stopping
+        )
+
+    async def _process_user_updates(self, updates, semaphore):
+        async with semaphore:
+            for update in updates:
+                await self.app.process_update(update)
+
+    async def _process_batch(self, per_user, semaphore):
+        """Process per-user lists of old updates, users concurrently"""
+        await asyncio.gather(
+            *(self._process_user_updates(user_updates, semaphore) for user_updates in per_user)
+        )
+
+    async def _replay_journal(self, semaphore) -> int:
+        """Handle the updates the last run fetched but didn't get to; returns
+        the highest update id among them"""
+        left = [Update.de_json(data, self.app.bot) for data in await self.journal.open()]
+        if not left:
+            return 0
+        per_user = collapse_updates(left)
+        await self._process_batch(per_user, semaphore)
+        await self.journal.remove([update.update_id for update in left])
+        processed = sum(len(user_updates) for user_updates in per_user)
+        logger.info(
+            f"📒 Handled {len(left)} updates left over from the last run "
+            f"({len(left) - processed} duplicates collapsed)"
+        )
+        return left[-1].update_id
+
+    async def catch_up(self) -> int:
+        """Process updates that queued up while the bot was down, each page
+        before fetching the next. Different users run concurrently, each
+        user's updates stay in order."""
+        semaphore = asyncio.Semaphore(self.backlog_concurrency)
+        # The last page of the previous run may have gone unconfirmed too
+        seen = await self._replay_journal(semaphore) if self.journal else 0
+        backlog = Backlog(lambda offset: self._get_updates(offset, timeout=0), seen)
+        async for per_user in backlog.batches():
+            await self._process_batch(per_user, semaphore)
+
+        self._next_offset = backlog.next_offset
+        backlog.log_summary()
+        return backlog.total
+
+    def _on_update_done(self, update):
+        if self.journal and isinstance(update, Update):
+            self._handled.append(update.update_id)
+            if self._forget_task is None or self._forget_task.done():
+                self._forget_task = asyncio.create_task(self._forget_handled())
+
+    async def _forget_handled(self):
+        """Remove handled updates from the journal, in batches"""
+        while self._handled:
+            update_ids, self._handled = self._handled, []
+            try:
+                await self.journal.remove(update_ids)
+            except sqlite3.Error as e:
+                # They are handled again on the next start
+                logger.warning(f"Could not remove {len(update_ids)} updates from the journal: {e}")
+
+    async def poll(self):
+        """Fetch updates into the application's update queue until cancelled"""
+        while True:
+            updates = await self._get_updates(self._next_offset, self.poll_timeout)
+            if not updates:
+                continue
+
+            # Journaled before the next getUpdates confirms them to Telegram
+            if self.journal:
+                try:
+                    await self.journal.add(updates)
+                except sqlite3.Error as e:
+                    logger.error(f"Could not journal updates: {e}, fetching them again")
+                    await asyncio.sleep(1)
+                    continue
+
+            for update in updates:
+                await self.app.update_queue.put(update)
+            self._next_offset = updates[-1].update_id + 1
+
+    def _discard_queued(self) -> int:
+        """Take updates the application hasn't picked up out of the queue;
+        returns how many"""
+        discarded = 0
+        while True:
+            try:
+                self.app.update_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return discarded
+            self.app.update_queue.task_done()
+            discarded += 1
+
+    async def drain(self):
+        """Wait for already received updates to be handled, up to the deadline.
+        Updates still queued after that are not handled by this process."""
+        try:
+            await asyncio.wait_for(self.app.update_queue.join(), timeout=self.drain_timeout)
+            logger.info("✅ All in-flight updates handled")
+            return
+        except asyncio.TimeoutError:
+            pass
+
+        discarded = self._discard_queued() + self.app.update_processor.skip_waiting()
+        if self._polling and self.journal:
+            fate = "kept in the update journal for the next start"
+        else:
+            fate = "dropped"
+        logger.warning(
+            f"⚠️ Drain deadline of {self.drain_timeout}s reached: {discarded} updates not "
+            f"started are {fate}; waiting for the ones already being handled"
+        )
+
+    async def confirm(self):
+        """Confirm the last fetched page to Telegram before exiting"""
+        if self._next_offset is None:
+            return
+        try:
+            await self.app.bot.get_updates(
+                offset=self._next_offset,
+                limit=1,
+                timeout=0,
+                allowed_updates=self.allowed_updates
+            )
+        except TelegramError as e:
+            logger.warning(f"Could not confirm handled updates: {e}")
+
+    async def flush(self):
+        """Run flush hooks, never letting one failure skip the others"""
+        for hook in self._flush_hooks:
+            try:
+                await hook()
+            except Exception as e:
+                logger.error(f"Flush hook {hook} failed: {e}")
+
+    async def _start(self):
+        await self.app.start()
+        self._background_tasks = [
+            asyncio.create_task(coroutine_function()) for coroutine_function in self._background
+        ]
+
+    async def _shutdown(self):
+        """Let handlers finish what was already received, then stop"""
+        await self.drain()
+        await self.app.stop()
+        if self._polling:
+            await self.confirm()
+        if self.journal:
+            if self._forget_task is not None:
+                await self._forget_task
+            await self._forget_handled()
+            await self.journal.close()
+        await self._cancel_background_tasks()
+        await self.flush()
+
+    async def run(self):
+        """Start, catch up, poll until stopped, then shut down gracefully"""
+        self._stop_event = asyncio.Event()
+        install_stop_handlers(self.request_stop)
+        self.app.update_processor.add_done_callback(self._on_update_done)
+
+        async with self.app:
+            await self._start()
+            await self.catch_up()
+
+            self._polling = True
+            poll_task = asyncio.create_task(self.poll())
+            logger.info("🤖 Bot is now running and polling for updates...")
+
+            await self._stop_event.wait()
+            logger.info("🛑 Shutting down: no longer accepting updates")
+
+            # Stop intake first, then let handlers finish what was already received
+            poll_task.cancel()
+            await asyncio.gather(poll_task, return_exceptions=True)
+            await self._shutdown()
+
+    async def run_fed(self, feed):
+        """Run without polling: `feed(app)` puts updates into the application's
+        update queue and returns when there are no more, then shut down gracefully"""
+        async with self.app:
+            await self._start()
+            await feed(self.app)
+            await self._shutdown()
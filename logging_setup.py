@@ -0,0 +1,218 @@
+"""
+Non-blocking logging pipeline: records are queued on the event loop thread and
+formatted/written by a background listener thread
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from telegram import Update
+from telegram.ext import ConversationHandler
+
+# Per-update context, attached to every record logged while handling an update
+update_id_var = contextvars.ContextVar("update_id", default=None)
+user_id_var = contextvars.ContextVar("user_id", default=None)
+handler_var = contextvars.ContextVar("handler", default=None)
+
+CONTEXT_FIELDS = ("update_id", "user_id", "handler", "duration_ms")
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+class ContextFilter(logging.Filter):
+    """Copy the current update context onto the record.
+
+    Runs in the thread that logs, before the record crosses to the listener
+    thread where the context variables are no longer visible."""
+
+    def filter(self, record):
+        if getattr(record, "update_id", None) is None:
+            record.update_id = update_id_var.get()
+        if getattr(record, "user_id", None) is None:
+            record.user_id = user_id_var.get()
+        if getattr(record, "handler", None) is None:
+            record.handler = handler_var.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of INFO records logged with extra={'sampled': True}"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno == logging.INFO and getattr(record, "sampled", False):
+            return random.random() < self.rate
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Queue handler that never blocks and leaves formatting to the listener"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The record stays in-process, so there's no need to pre-format or pickle it
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class ProcessQueueHandler(NonBlockingQueueHandler):
+    """Queue handler for worker processes. Records are pickled across to the
+    front process, so they are pre-formatted like the stock QueueHandler does."""
+
+    def prepare(self, record):
+        record = QueueHandler.prepare(self, record)
+        # Already sampled in the worker, the front process must not sample again
+        record.sampled = False
+        return record
+
+class ForwardingHandler(logging.Handler):
+    """Hand records received from worker processes to this process's loggers"""
+
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+def setup_queued_logging(level: str, log_file: str, log_format: str = "text",
+                         sample_rate: float = 1.0, queue_size: int = 10000) -> QueueListener:
+    """Route all logging through a queue to a background listener thread.
+    Returns the started listener; stop it on exit to flush pending records."""
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+
+    if log_format == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+
+    console_handler = logging.StreamHandler(sys.stdout)
+    file_handler = RotatingFileHandler(
+        log_file,
+        maxBytes=10*1024*1024,  # 10MB
+        backupCount=5
+    )
+    for handler in (console_handler, file_handler):
+        handler.setFormatter(formatter)
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(getattr(logging, level.upper()))
+
+    listener = QueueListener(queue_handler.queue, console_handler, file_handler)
+    listener.start()
+    return listener
+
+def setup_queued_file_log(logger_name: str, log_file: str, queue_size: int = 1000) -> QueueListener:
+    """Send one logger's raw messages to its own rotating file, written by a
+    background thread. Returns the started listener."""
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+
+    file_handler = RotatingFileHandler(
+        log_file,
+        maxBytes=10*1024*1024,  # 10MB
+        backupCount=3
+    )
+    file_handler.setFormatter(logging.Formatter('%(message)s'))
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    logger = logging.getLogger(logger_name)
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+
+    listener = QueueListener(queue_handler.queue, file_handler)
+    listener.start()
+    return listener
+
+def setup_worker_logging(level: str, log_queue, sample_rate: float = 1.0):
+    """Send all logging of a worker process to the front process over `log_queue`"""
+    queue_handler = ProcessQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(getattr(logging, level.upper()))
+
+def listen_for_worker_logs(log_queue) -> QueueListener:
+    """Feed records from worker processes into this process's logging pipeline.
+    Returns the started listener."""
+    listener = QueueListener(log_queue, ForwardingHandler())
+    listener.start()
+    return listener
+
+async def bind_log_context(update: object, context):
+    """Group -100 handler: remember which update and user is being processed"""
+    if isinstance(update, Update):
+        update_id_var.set(update.update_id)
+        user_id_var.set(update.effective_user.id if update.effective_user else None)
+    handler_var.set(None)
+
+def track_handler(callback):
+    """Wrap a handler callback to log its name and duration"""
+    name = getattr(callback, "__qualname__", repr(callback))
+    logger = logging.getLogger("handlers")
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        handler_var.set(name)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            logger.info(
+                "Handled update",
+                extra={
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                    "sampled": True
+                }
+            )
+
+    return wrapper
+
+def instrument_handlers(handlers):
+    """Wrap the callbacks of all given handlers, including conversation states"""
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        elif not getattr(handler.callback, "__wrapped__", None):
+            handler.callback = track_handler(handler.callback)
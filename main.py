@@ -3,23 +3,39 @@ Enhanced main bot application file with Railway deployment support
 """
 
 import asyncio
+import atexit
 import logging
 import os
 import sys
 import threading
-from logging.handlers import RotatingFileHandler
+from urllib.parse import urlparse
+from telegram import Bot, Update
 from telegram.ext import (
     Application, 
     CommandHandler, 
     CallbackQueryHandler, 
     MessageHandler, 
     ConversationHandler,
+    InlineQueryHandler,
+    ChosenInlineResultHandler,
+    TypeHandler,
     filters
 )
 
-from config import BOT_TOKEN, LOG_LEVEL, LOG_FILE
+from config import (
+    ensure_directories, BOT_TOKEN, LOG_LEVEL, LOG_FILE, LOG_FORMAT, LOG_SAMPLE_RATE, LOG_QUEUE_SIZE,
+    API_RATE_LIMIT, API_CHAT_RATE_LIMIT, API_CHAT_BURST, API_GROUP_RATE_LIMIT, API_MAX_RETRIES,
+    HTTP_UPLOAD_POOL_SIZE, HTTP_UPLOAD_TIMEOUT, HTTP_INTERACTIVE_POOL_SIZE, HTTP_INTERACTIVE_TIMEOUT,
+    HTTP_UPDATES_TIMEOUT, HTTP_KEEPALIVE_EXPIRY, SHUTDOWN_DRAIN_TIMEOUT, BACKLOG_CONCURRENCY,
+    CONCURRENT_UPDATES, UPDATE_JOURNAL_PATH,
+    SEGMENT_REFRESH_INTERVAL, SLOW_LOG_FILE, DATABASE_PATH, BACKUP_DIR, BACKUP_INTERVAL,
+    BACKUP_KEEP, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP, WORKER_PROCESSES,
+    WORKER_HEARTBEAT_INTERVAL, WEBHOOK_URL, WEBHOOK_PORT, WEBHOOK_SECRET,
+    UPDATE_CAPTURE_DIR, UPDATE_CAPTURE_SALT, UPDATE_CAPTURE_SEGMENT_SIZE
+)
 from handlers.start import start_command, subscription_callback
 from handlers.books import handle_book_code
+from handlers.inline import inline_search, inline_result_chosen
 from handlers.admin import (
     admin_menu, 
     admin_callback_handler,
@@ -28,35 +44,50 @@ from handlers.admin import (
     handle_book_file,
     handle_test_file,
     handle_broadcast_message,
+    handle_broadcast_segment,
+    handle_broadcast_book_code,
     cancel_conversation,
     WAITING_BOOK_CODE,
     WAITING_BOOK_TITLE,
     WAITING_BOOK_FILE,
     WAITING_TEST_FILE,
-    WAITING_BROADCAST_MESSAGE
+    WAITING_BROADCAST_MESSAGE,
+    WAITING_BROADCAST_SEGMENT,
+    WAITING_BROADCAST_BOOK_CODE
 )
 from database.db_manager import DatabaseManager
+from database.segments import segment_sizes
+from database.backup import BackupManager
+from utils.reachability import reachability
+from utils.scheduler import RequestScheduler
+from utils.async_files import run_blocking
+from utils.lifecycle import LifecycleManager, PerUserUpdateProcessor, UpdateJournal
+from utils.request_pools import PooledHTTPXRequest, RoutingRequest
+from utils.logging_setup import (
+    setup_queued_logging, setup_queued_file_log, bind_log_context, instrument_handlers
+)
+from utils.profiler import ProfiledApplication, slow_log
+from utils.workers import WorkerPool
+from utils.capture import UpdateRecorder, RecordingQueue
+from health_check import set_status_provider
+
+ALLOWED_UPDATES = ["message", "callback_query", "inline_query", "chosen_inline_result"]
 
 def setup_logging():
     """Setup logging configuration for production"""
-    # Create logs directory if it doesn't exist
-    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
-    
-    # Configure logging
-    logging.basicConfig(
-        level=getattr(logging, LOG_LEVEL.upper()),
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            # Console handler
-            logging.StreamHandler(sys.stdout),
-            # File handler with rotation
-            RotatingFileHandler(
-                LOG_FILE,
-                maxBytes=10*1024*1024,  # 10MB
-                backupCount=5
-            )
-        ]
+    # Formatting and file writes happen on a background listener thread
+    listener = setup_queued_logging(
+        LOG_LEVEL,
+        LOG_FILE,
+        log_format=LOG_FORMAT,
+        sample_rate=LOG_SAMPLE_RATE,
+        queue_size=LOG_QUEUE_SIZE
     )
+    atexit.register(listener.stop)
+    
+    # Slow updates get their own rolling JSON-lines file
+    slow_listener = setup_queued_file_log("slow_updates", SLOW_LOG_FILE)
+    atexit.register(slow_listener.stop)
     
     # Set specific loggers
     logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -64,6 +95,39 @@ def setup_logging():
     
     return logging.getLogger(__name__)
 
+def build_requests():
+    """Dedicated HTTP pools: file uploads, small interactive calls and getUpdates"""
+    request = RoutingRequest(
+        upload=PooledHTTPXRequest(
+            "upload",
+            HTTP_UPLOAD_POOL_SIZE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            read_timeout=HTTP_UPLOAD_TIMEOUT,
+            write_timeout=HTTP_UPLOAD_TIMEOUT,
+            connect_timeout=HTTP_INTERACTIVE_TIMEOUT,
+            pool_timeout=HTTP_UPLOAD_TIMEOUT
+        ),
+        interactive=PooledHTTPXRequest(
+            "interactive",
+            HTTP_INTERACTIVE_POOL_SIZE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            read_timeout=HTTP_INTERACTIVE_TIMEOUT,
+            write_timeout=HTTP_INTERACTIVE_TIMEOUT,
+            connect_timeout=HTTP_INTERACTIVE_TIMEOUT,
+            pool_timeout=HTTP_INTERACTIVE_TIMEOUT
+        )
+    )
+    # Long polling holds its single connection open, so it gets one of its own
+    get_updates_request = PooledHTTPXRequest(
+        "updates",
+        1,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        read_timeout=HTTP_UPDATES_TIMEOUT,
+        connect_timeout=HTTP_INTERACTIVE_TIMEOUT,
+        pool_timeout=HTTP_UPDATES_TIMEOUT
+    )
+    return request, get_updates_request
+
 def start_health_server():
     """Start health check server for Railway"""
     from health_check import start_health_server
@@ -86,6 +150,175 @@ async def error_handler(update, context):
         except Exception:
             pass
 
+def build_application(worker_count: int = 1, update_queue=None, requests=None) -> Application:
+    """Create the application with all handlers registered.
+
+    In multi-process mode each of the `worker_count` workers gets an equal
+    share of the API rate limit, which also caps broadcasts since they run in
+    a single worker, and no updater of its own. `requests` is an
+    optional (request, get_updates_request) pair replacing the HTTP pools."""
+    # All outgoing API calls are queued by priority and retried on flood control
+    scheduler = RequestScheduler(
+        global_rate=API_RATE_LIMIT / worker_count,
+        chat_rate=API_CHAT_RATE_LIMIT,
+        chat_burst=API_CHAT_BURST,
+        group_rate=API_GROUP_RATE_LIMIT / 60,
+        max_retries=API_MAX_RETRIES
+    )
+    
+    # Create application
+    request, get_updates_request = requests or build_requests()
+    builder = (
+        Application.builder()
+        .application_class(ProfiledApplication)
+        .token(BOT_TOKEN)
+        .request(request)
+        .rate_limiter(scheduler)
+        # Slow handlers (uploads, broadcasts) must not hold up other users
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+    )
+    if update_queue is not None:
+        builder = builder.update_queue(update_queue)
+    if worker_count > 1:
+        # Updates arrive from the front process
+        builder = builder.updater(None)
+    else:
+        builder = builder.get_updates_request(get_updates_request)
+    app = builder.build()
+    
+    # Add error handler
+    app.add_error_handler(error_handler)
+    
+    # Add book conversation handler for admin
+    add_book_conv_handler = ConversationHandler(
+        entry_points=[CallbackQueryHandler(admin_callback_handler, pattern="^admin_add_book$")],
+        states={
+            WAITING_BOOK_CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_handle_book_code)],
+            WAITING_BOOK_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_book_title)],
+            WAITING_BOOK_FILE: [MessageHandler(filters.Document.ALL, handle_book_file)],
+            WAITING_TEST_FILE: [MessageHandler(filters.Document.ALL, handle_test_file)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel_conversation)],
+    )
+    
+    # Add broadcast conversation handler for admin
+    broadcast_conv_handler = ConversationHandler(
+        entry_points=[CallbackQueryHandler(admin_callback_handler, pattern="^admin_broadcast$")],
+        states={
+            WAITING_BROADCAST_SEGMENT: [CallbackQueryHandler(handle_broadcast_segment, pattern="^segment_")],
+            WAITING_BROADCAST_BOOK_CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_broadcast_book_code)],
+            WAITING_BROADCAST_MESSAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_broadcast_message)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel_conversation)],
+    )
+    
+    # Add handlers
+    app.add_handler(CommandHandler("start", start_command))
+    app.add_handler(CommandHandler("admin", admin_menu))
+    app.add_handler(add_book_conv_handler)
+    app.add_handler(broadcast_conv_handler)
+    app.add_handler(CallbackQueryHandler(subscription_callback, pattern="^check_subscription$"))
+    app.add_handler(CallbackQueryHandler(admin_callback_handler))
+    app.add_handler(InlineQueryHandler(inline_search))
+    app.add_handler(ChosenInlineResultHandler(inline_result_chosen))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_book_code))
+    
+    # Log handler name and duration, tagged with the update and user; every
+    # group-0 handler must be registered by now
+    instrument_handlers(app.handlers[0])
+    app.add_handler(TypeHandler(Update, bind_log_context), group=-100)
+    
+    # Users who blocked the bot become reachable again on their next update
+    app.add_handler(TypeHandler(Update, reachability.reactivate), group=-99)
+    
+    return app
+
+def build_lifecycle(app: Application, db_manager: DatabaseManager, worker_count: int = 1) -> LifecycleManager:
+    """Lifecycle manager with the background tasks every bot process runs"""
+    lifecycle = LifecycleManager(
+        app,
+        allowed_updates=ALLOWED_UPDATES,
+        drain_timeout=SHUTDOWN_DRAIN_TIMEOUT,
+        backlog_concurrency=BACKLOG_CONCURRENCY,
+        # Workers don't poll; the front process receives their updates
+        journal=UpdateJournal(UPDATE_JOURNAL_PATH) if worker_count == 1 else None
+    )
+    lifecycle.add_background_task(
+        lambda: segment_sizes.refresh_forever(db_manager, SEGMENT_REFRESH_INTERVAL)
+    )
+    if worker_count > 1:
+        # Users may be marked unreachable by a broadcast running in another worker
+        lifecycle.add_background_task(
+            lambda: reachability.refresh_forever(SEGMENT_REFRESH_INTERVAL)
+        )
+    return lifecycle
+
+async def create_worker(worker_count: int) -> LifecycleManager:
+    """Per-process setup of a worker in multi-process mode"""
+    await reachability.load()
+    # The front process writes every worker's slow updates to one file
+    slow_log.read_from(SLOW_LOG_FILE)
+    app = build_application(worker_count)
+    return build_lifecycle(app, DatabaseManager(), worker_count)
+
+def build_backups():
+    """Backup manager, or None if backups are disabled"""
+    if BACKUP_INTERVAL <= 0:
+        return None
+    return BackupManager(
+        DATABASE_PATH,
+        BACKUP_DIR,
+        keep=BACKUP_KEEP,
+        pages_per_step=BACKUP_PAGES_PER_STEP,
+        step_sleep=BACKUP_STEP_SLEEP
+    )
+
+def build_recorder():
+    """Update recorder, or None if capturing is disabled"""
+    if not UPDATE_CAPTURE_DIR:
+        return None
+    return UpdateRecorder(
+        UPDATE_CAPTURE_DIR,
+        salt=UPDATE_CAPTURE_SALT,
+        segment_size=UPDATE_CAPTURE_SEGMENT_SIZE
+    )
+
+async def run_worker_pool(backups, recorder):
+    """Front process of multi-process mode: receive updates and dispatch them to workers"""
+    pool = WorkerPool(
+        create_worker,
+        WORKER_PROCESSES,
+        heartbeat_interval=WORKER_HEARTBEAT_INTERVAL,
+        drain_timeout=SHUTDOWN_DRAIN_TIMEOUT
+    )
+    set_status_provider(lambda: pool.status)
+    
+    request, get_updates_request = build_requests()
+    bot = Bot(BOT_TOKEN, request=request, get_updates_request=get_updates_request)
+    
+    webhook = None
+    if WEBHOOK_URL:
+        webhook = {
+            "listen": "0.0.0.0",
+            "port": WEBHOOK_PORT,
+            "url_path": urlparse(WEBHOOK_URL).path.lstrip("/"),
+            "webhook_url": WEBHOOK_URL,
+            "secret_token": WEBHOOK_SECRET or None,
+        }
+    
+    # Backups run once, in the front process
+    background = []
+    if backups:
+        background.append(lambda: backups.run_forever(BACKUP_INTERVAL))
+    update_queue = RecordingQueue(recorder) if recorder else None
+    try:
+        await pool.run(
+            bot, ALLOWED_UPDATES, webhook=webhook, background=background, update_queue=update_queue
+        )
+    finally:
+        if recorder:
+            await recorder.close()
+
 async def main():
     """Main function to start the bot"""
     logger = setup_logging()
@@ -98,57 +331,35 @@ async def main():
         logger.info("✅ Health check server started for Railway")
     
     try:
+        await run_blocking(ensure_directories)
+        
         # Initialize database
         db_manager = DatabaseManager()
         await db_manager.init_database()
         logger.info("✅ Database initialized successfully")
+        backups = build_backups()
+        recorder = build_recorder()
         
-        # Create application
-        app = Application.builder().token(BOT_TOKEN).build()
-        
-        # Add error handler
-        app.add_error_handler(error_handler)
-        
-        # Add book conversation handler for admin
-        add_book_conv_handler = ConversationHandler(
-            entry_points=[CallbackQueryHandler(admin_callback_handler, pattern="^admin_add_book$")],
-            states={
-                WAITING_BOOK_CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_handle_book_code)],
-                WAITING_BOOK_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_book_title)],
-                WAITING_BOOK_FILE: [MessageHandler(filters.Document.ALL, handle_book_file)],
-                WAITING_TEST_FILE: [MessageHandler(filters.Document.ALL, handle_test_file)],
-            },
-            fallbacks=[CommandHandler("cancel", cancel_conversation)],
-        )
-        
-        # Add broadcast conversation handler for admin
-        broadcast_conv_handler = ConversationHandler(
-            entry_points=[CallbackQueryHandler(admin_callback_handler, pattern="^admin_broadcast$")],
-            states={
-                WAITING_BROADCAST_MESSAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_broadcast_message)],
-            },
-            fallbacks=[CommandHandler("cancel", cancel_conversation)],
-        )
+        logger.info(f"🔗 Bot username: @{os.getenv('BOT_USERNAME', 'Kitob_Bazasi_botAIPromptYordamchi_Bot')}")
         
-        # Add handlers
-        app.add_handler(CommandHandler("start", start_command))
-        app.add_handler(CommandHandler("admin", admin_menu))
-        app.add_handler(add_book_conv_handler)
-        app.add_handler(broadcast_conv_handler)
-        app.add_handler(CallbackQueryHandler(subscription_callback, pattern="^check_subscription$"))
-        app.add_handler(CallbackQueryHandler(admin_callback_handler))
-        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_book_code))
+        if WORKER_PROCESSES > 1:
+            logger.info(f"👷 Starting {WORKER_PROCESSES} worker processes")
+            await run_worker_pool(backups, recorder)
+            logger.info("🛑 Bot stopped")
+            return
         
+        await reachability.load()
+        app = build_application(update_queue=RecordingQueue(recorder) if recorder else None)
         logger.info("✅ All handlers registered successfully")
         
-        # Start the bot
-        logger.info("🤖 Bot is now running and polling for updates...")
-        logger.info(f"🔗 Bot username: @{os.getenv('BOT_USERNAME', 'Kitob_Bazasi_botAIPromptYordamchi_Bot')}")
-        
-        await app.run_polling(
-            allowed_updates=["message", "callback_query"],
-            drop_pending_updates=True
-        )
+        # Start the bot: catch up on updates sent during the restart, then poll
+        lifecycle = build_lifecycle(app, db_manager)
+        if backups:
+            lifecycle.add_background_task(lambda: backups.run_forever(BACKUP_INTERVAL))
+        if recorder:
+            lifecycle.add_flush_hook(recorder.close)
+        await lifecycle.run()
+        logger.info("🛑 Bot stopped")
         
     except Exception as e:
         logger.error(f"❌ Failed to start bot: {e}")
@@ -0,0 +1,181 @@
+"""
+Per-update timing: every update is timed end to end and broken down into
+database, filesystem and Telegram API phases. Slow updates go to a rolling
+slow-log, optionally with a sampled cProfile capture.
+"""
+import asyncio
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from telegram import Update
+from telegram.ext import Application
+
+from config import (
+    SLOW_UPDATE_THRESHOLD_MS, SLOW_LOG_SIZE, SLOW_PROFILE_SAMPLE_RATE, PROFILE_DIR
+)
+from utils.logging_setup import handler_var
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("slow_updates")
+
+PHASES = ("db", "fs", "api")
+
+_current_profile = contextvars.ContextVar("update_profile", default=None)
+
+class UpdateProfile:
+    """Timings collected while one update is processed"""
+
+    def __init__(self, update: object):
+        self.update_id = getattr(update, "update_id", None)
+        user = update.effective_user if isinstance(update, Update) else None
+        self.user_id = user.id if user else None
+        self.handler = None
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.started = time.perf_counter()
+        self.total = None
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+        self.handler = handler_var.get()
+
+    def to_dict(self) -> dict:
+        accounted = sum(self.phases.values())
+        return {
+            "ts": datetime.now().isoformat(timespec="seconds"),
+            "update_id": self.update_id,
+            "user_id": self.user_id,
+            "handler": self.handler,
+            "total_ms": round(self.total * 1000, 1),
+            **{f"{name}_ms": round(self.phases[name] * 1000, 1) for name in PHASES},
+            **{f"{name}_calls": self.calls[name] for name in PHASES},
+            # Whatever isn't DB, disk or API: Python code and waiting on the loop
+            "other_ms": round(max(0.0, self.total - accounted) * 1000, 1),
+        }
+
+@contextmanager
+def phase(name: str):
+    """Attribute the time spent inside the block to a phase of the current update"""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.phases[name] += time.perf_counter() - started
+        profile.calls[name] += 1
+
+class SlowLog:
+    """Most recent slow updates in memory, plus a rolling JSON-lines file"""
+
+    def __init__(self, threshold_ms: float = 1000, size: int = 200,
+                 profile_sample_rate: float = 0.0, profile_dir: str = "logs/profiles"):
+        self.threshold_ms = threshold_ms
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_dir = profile_dir
+        self.size = size
+        self.entries = deque(maxlen=size)
+        self.log_file = None
+        self._profiling = False
+
+    def read_from(self, log_file: str):
+        """Answer `worst()` from the slow-log file instead of memory. In
+        multi-process mode the front process writes every worker's entries
+        there, while each worker only remembers its own."""
+        self.log_file = log_file
+
+    def start_profiler(self):
+        """cProfile for a sampled share of updates; one at a time, since
+        the profiler sees the whole thread"""
+        if self._profiling or random.random() >= self.profile_sample_rate:
+            return None
+        self._profiling = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    async def observe(self, profile: UpdateProfile, profiler=None):
+        """Record the update if it was slow"""
+        if profiler is not None:
+            profiler.disable()
+            self._profiling = False
+
+        entry = profile.to_dict()
+        if entry["total_ms"] < self.threshold_ms:
+            return
+
+        if profiler is not None:
+            path = os.path.join(self.profile_dir, f"update_{profile.update_id}.prof")
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._dump, profiler, path)
+                entry["profile"] = path
+            except OSError as e:
+                logger.warning(f"Could not save profile {path}: {e}")
+
+        self.entries.append(entry)
+        slow_logger.warning(json.dumps(entry, ensure_ascii=False))
+
+    def _dump(self, profiler, path: str):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profiler.dump_stats(path)
+
+    def _read_file(self):
+        """The last `size` entries of the slow-log file"""
+        try:
+            with open(self.log_file, 'rb') as file:
+                file.seek(0, os.SEEK_END)
+                # Entries are a few hundred bytes; a partial first line is skipped
+                start = max(0, file.tell() - self.size * 1024)
+                file.seek(start)
+                lines = file.read().splitlines()
+        except FileNotFoundError:
+            return []
+        if start:
+            lines = lines[1:]
+
+        entries = []
+        for line in lines[-self.size:]:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        return entries
+
+    async def worst(self, count: int = 10):
+        """Slowest recent updates first"""
+        entries = self.entries
+        if self.log_file:
+            entries = await asyncio.get_running_loop().run_in_executor(None, self._read_file)
+        return sorted(entries, key=lambda entry: entry["total_ms"], reverse=True)[:count]
+
+slow_log = SlowLog(
+    threshold_ms=SLOW_UPDATE_THRESHOLD_MS,
+    size=SLOW_LOG_SIZE,
+    profile_sample_rate=SLOW_PROFILE_SAMPLE_RATE,
+    profile_dir=PROFILE_DIR
+)
+
+class ProfiledApplication(Application):
+    """Application that times every update it processes"""
+
+    async def process_update(self, update: object):
+        profile = UpdateProfile(update)
+        token = _current_profile.set(profile)
+        profiler = slow_log.start_profiler()
+        try:
+            await super().process_update(update)
+        finally:
+            profile.finish()
+            _current_profile.reset(token)
+            await slow_log.observe(profile, profiler)
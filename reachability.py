@@ -0,0 +1,60 @@
+"""
+Tracks users the bot can no longer message (blocked the bot, deleted account)
+so bulk operations can skip them
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from telegram import Update
+from telegram.error import BadRequest, Forbidden, TelegramError
+
+from database.db_manager import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+def unreachable_reason(error: TelegramError) -> Optional[str]:
+    """Reason to record if the error means the user can't be messaged at all"""
+    if isinstance(error, Forbidden):
+        # "bot was blocked by the user", "user is deactivated"
+        return "forbidden"
+    if isinstance(error, BadRequest) and "chat not found" in error.message.lower():
+        return "chat_not_found"
+    return None
+
+class ReachabilityTracker:
+    """Keeps the set of unreachable users in memory, so re-activating a
+    returning user costs a DB write only for users who were actually marked"""
+
+    def __init__(self, db_manager: DatabaseManager):
+        self.db_manager = db_manager
+        self._unreachable = set()
+
+    async def load(self):
+        """Load unreachable users from the database"""
+        self._unreachable = set(await self.db_manager.get_unreachable_users())
+        logger.info(f"🚫 {len(self._unreachable)} users marked unreachable")
+
+    async def refresh_forever(self, interval: float):
+        """Background task re-reading the set, for when other processes mark users"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error(f"Failed to reload unreachable users: {e}")
+
+    async def mark_unreachable(self, user_id: int, reason: str):
+        self._unreachable.add(user_id)
+        await self.db_manager.mark_unreachable(user_id, reason)
+
+    async def reactivate(self, update: object, context):
+        """Group -99 handler: any update from a user proves they're reachable again"""
+        if not isinstance(update, Update) or not update.effective_user:
+            return
+        user_id = update.effective_user.id
+        if user_id in self._unreachable:
+            self._unreachable.discard(user_id)
+            await self.db_manager.mark_reachable(user_id)
+
+reachability = ReachabilityTracker(DatabaseManager())
@@ -0,0 +1,230 @@
+"""
+Replays captured update traffic through the bot's handler stack against a
+local fake Bot API, keeping the original timing
+
+Usage:
+    python replay.py captures/                     # every segment in a directory, real time
+    python replay.py captures/ --speed 10          # ten times faster
+    python replay.py captures/ --speed 0           # as fast as the bot can take them
+    python replay.py captures/ --db restored.db    # run against a copy of real data
+
+Captures are written by the bot when UPDATE_CAPTURE_DIR is set. The report is
+JSON with latency percentiles (ms, from arrival to handled, so queueing
+behind a spike counts) overall and per update type, plus the error rate.
+"""
+import argparse
+import asyncio
+import contextlib
+import glob
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+from bench_common import peak_rss_mb, percentile
+
+def summarize(latencies) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "updates": len(latencies),
+        "latency_ms": {
+            name: round(percentile(latencies, pct) * 1000, 2)
+            for name, pct in (("p50", 50), ("p90", 90), ("p95", 95), ("p99", 99), ("max", 100))
+        }
+    }
+
+def update_type(update: Update) -> str:
+    if update.message:
+        return "command" if (update.message.text or "").startswith("/") else "message"
+    if update.callback_query:
+        return "callback_query"
+    if update.inline_query:
+        return "inline_query"
+    if update.chosen_inline_result:
+        return "chosen_inline_result"
+    return "other"
+
+def load_capture(paths, limit=None):
+    """Captured records from files and directories, in arrival order"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "updates-*.jsonl"))))
+        else:
+            files.append(path)
+
+    records = []
+    for path in files:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    records.sort(key=lambda record: record["t"])
+    return files, records[:limit] if limit else records
+
+class FakeBotAPI(BaseRequest):
+    """Answers every Bot API call locally after a fixed delay"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _result(self, endpoint: str, params: dict):
+        if endpoint == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Replay", "username": "replay_bot"}
+        if endpoint == "getChatMember":
+            user = {"id": params.get("user_id", 1), "is_bot": False, "first_name": "User"}
+            return {"status": "member", "user": user}
+        if endpoint.startswith("send") or endpoint in ("editMessageText", "copyMessage"):
+            self._message_id += 1
+            message = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": params.get("chat_id", 1), "type": "private"},
+                "text": params.get("text", ""),
+            }
+            if endpoint == "sendDocument":
+                file_id = f"replay-{self._message_id}"
+                message["document"] = {"file_id": file_id, "file_unique_id": file_id}
+            return message
+        if endpoint == "getUpdates":
+            return []
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        body = json.dumps({"ok": True, "result": self._result(endpoint, params)})
+        return 200, body.encode()
+
+async def run_replay(args) -> dict:
+    # Handler modules create their DatabaseManager on import, so point the
+    # configuration at the replay database first
+    db_path = args.db or os.path.join(tempfile.gettempdir(), "replay_database.db")
+    if not args.db and os.path.exists(db_path):
+        os.remove(db_path)
+    os.environ["DATABASE_PATH"] = db_path
+    with contextlib.redirect_stdout(sys.stderr):
+        import main as bot
+        from database.db_manager import DatabaseManager
+        from utils.reachability import reachability
+
+    files, records = load_capture(args.captures, args.limit)
+    if not records:
+        raise SystemExit("No captured updates found")
+
+    await DatabaseManager().init_database()
+    await reachability.load()
+
+    api = FakeBotAPI(args.api_latency / 1000)
+    app = bot.build_application(requests=(api, api))
+
+    errors = Counter()
+    latencies = defaultdict(list)
+    arrived = {}
+    max_backlog = 0
+
+    async def count_error(update, context):
+        errors[type(context.error).__name__] += 1
+    app.add_error_handler(count_error)
+
+    process_update = app.process_update
+
+    async def timed_process_update(update):
+        try:
+            await process_update(update)
+        finally:
+            started = arrived.pop(id(update), None)
+            if started is not None:
+                latencies[update_type(update)].append(time.perf_counter() - started)
+    app.process_update = timed_process_update
+
+    async with app:
+        await app.start()
+        started = time.perf_counter()
+        first = records[0]["t"]
+        for record in records:
+            if args.speed > 0:
+                delay = started + (record["t"] - first) / args.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            update = Update.de_json(record["update"], app.bot)
+            arrived[id(update)] = time.perf_counter()
+            await app.update_queue.put(update)
+            max_backlog = max(max_backlog, app.update_queue.qsize())
+        await app.update_queue.join()
+        wall_time = time.perf_counter() - started
+        await app.stop()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    total_errors = sum(errors.values())
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "captures": files,
+        "database_path": db_path,
+        "speed": args.speed,
+        "api_latency_ms": args.api_latency,
+        "updates": len(records),
+        "capture_span_seconds": round(records[-1]["t"] - first, 3),
+        "wall_time_seconds": round(wall_time, 3),
+        "updates_per_sec": round(len(records) / wall_time, 2) if wall_time else None,
+        "max_backlog": max_backlog,
+        "errors": total_errors,
+        "error_rate": round(total_errors / len(records), 4),
+        "errors_by_type": dict(errors),
+        "latency_ms": summarize(all_latencies)["latency_ms"],
+        "by_update_type": {kind: summarize(values) for kind, values in sorted(latencies.items())},
+        "api_calls": dict(api.calls.most_common()),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured updates against a fake Bot API")
+    parser.add_argument("captures", nargs="+", help="capture segments or directories holding them")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="playback speed multiplier, 0 for no pauses at all")
+    parser.add_argument("--api-latency", type=float, default=50, help="fake Bot API response time in ms")
+    parser.add_argument("--limit", type=int, help="replay only the first N updates")
+    parser.add_argument("--db", help="database to run against, e.g. a restored backup; it is "
+                                     "modified (default: a fresh temporary one)")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Handlers log per update; the report is what matters here
+    logging.basicConfig(level=logging.ERROR, stream=sys.stderr)
+    report = asyncio.run(run_replay(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Separate HTTP connection pools per traffic class for the Bot client, so file
+uploads can't starve small interactive calls
+"""
+import logging
+import time
+
+import httpx
+from telegram.request import BaseRequest, HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Type of the DEFAULT_NONE marker PTB passes when no timeout was given
+DefaultValue = type(BaseRequest.DEFAULT_NONE)
+
+class PooledHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest with a name, keep-alive setting and saturation reporting"""
+
+    # Saturation warnings are logged at most once per this many seconds
+    WARNING_INTERVAL = 10
+
+    def __init__(self, name: str, connection_pool_size: int, keepalive_expiry: float = 30,
+                 **kwargs):
+        # Used by _build_client(), which the parent constructor calls
+        self.name = name
+        self.pool_size = connection_pool_size
+        self.keepalive_expiry = keepalive_expiry
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.saturated_count = 0
+        self._last_warning = 0.0
+        super().__init__(connection_pool_size=connection_pool_size, **kwargs)
+
+    def _build_client(self) -> httpx.AsyncClient:
+        self._client_kwargs["limits"] = httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size,
+            keepalive_expiry=self.keepalive_expiry
+        )
+        return super()._build_client()
+
+    def stats(self) -> dict:
+        """Current pool usage, for logs and health reporting"""
+        return {
+            "pool": self.name,
+            "size": self.pool_size,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "saturated_count": self.saturated_count
+        }
+
+    def _report_saturation(self):
+        self.saturated_count += 1
+        now = time.monotonic()
+        if now - self._last_warning >= self.WARNING_INTERVAL:
+            self._last_warning = now
+            logger.warning(
+                f"HTTP pool '{self.name}' saturated: {self.in_flight} requests "
+                f"for {self.pool_size} connections"
+            )
+
+    async def do_request(self, url, method, request_data=None,
+                         read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        # HTTPXRequest hard-codes a 20s write timeout for uploads; use this pool's own
+        if isinstance(write_timeout, DefaultValue):
+            write_timeout = self._client.timeout.write
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        if self.in_flight > self.pool_size:
+            self._report_saturation()
+        try:
+            return await super().do_request(
+                url,
+                method,
+                request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout
+            )
+        finally:
+            self.in_flight -= 1
+
+class RoutingRequest(BaseRequest):
+    """Send file transfers through a dedicated pool and everything else
+    through the interactive pool"""
+
+    def __init__(self, upload: PooledHTTPXRequest, interactive: PooledHTTPXRequest):
+        self.upload = upload
+        self.interactive = interactive
+
+    @property
+    def read_timeout(self):
+        return self.interactive.read_timeout
+
+    async def initialize(self):
+        await self.upload.initialize()
+        await self.interactive.initialize()
+
+    async def shutdown(self):
+        await self.upload.shutdown()
+        await self.interactive.shutdown()
+
+    def stats(self) -> list:
+        return [self.upload.stats(), self.interactive.stats()]
+
+    async def do_request(self, url, method, request_data=None,
+                         read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        # File downloads (plain GETs) are as heavy as uploads
+        if method == "GET" or (request_data is not None and request_data.contains_files):
+            target = self.upload
+        else:
+            target = self.interactive
+        return await target.do_request(
+            url,
+            method,
+            request_data,
+            read_timeout=read_timeout,
+            write_timeout=write_timeout,
+            connect_timeout=connect_timeout,
+            pool_timeout=pool_timeout
+        )
@@ -0,0 +1,208 @@
+"""
+Central scheduler for outgoing Bot API requests: priorities, rate limits and
+automatic retries on flood control and timeouts
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from enum import IntEnum
+from typing import Any, Dict, Optional
+
+import httpx
+from telegram.error import RetryAfter, TimedOut
+from telegram.ext import BaseRateLimiter
+
+from utils.profiler import phase
+
+logger = logging.getLogger(__name__)
+
+class Priority(IntEnum):
+    """Lower value goes out first"""
+    INTERACTIVE = 0
+    SUBSCRIPTION = 1
+    BULK = 2
+
+# Endpoints whose priority differs from the interactive default
+ENDPOINT_PRIORITIES = {
+    "getChatMember": Priority.SUBSCRIPTION,
+}
+
+# Endpoints that post a message into a chat and count toward its per-chat limit
+CHAT_LIMITED_PREFIXES = ("send", "copyMessage", "forwardMessage")
+
+def safe_to_retry(endpoint: str, error: TimedOut) -> bool:
+    """A request that timed out may still have reached Telegram. Only repeat it
+    if doing so can't send a message or file twice."""
+    if not endpoint.startswith(CHAT_LIMITED_PREFIXES):
+        # Reads, answers and edits are harmless to repeat
+        return True
+    # No connection was made or none was free, so nothing was sent
+    return isinstance(error.__cause__, (httpx.ConnectTimeout, httpx.PoolTimeout))
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `capacity` saved up"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available, 0 if one is available now"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+class RequestScheduler(BaseRateLimiter[Dict[str, Any]]):
+    """Rate limiter every Bot API call passes through.
+
+    Requests wait for a per-chat slot first and then queue for a global slot in
+    priority order, so bulk sends never hold up replies to users. On RetryAfter
+    all requests are paused for the requested time before retrying.
+
+    Pass ``rate_limit_args={"priority": Priority.BULK}`` to a bot method to
+    override the priority inferred from the endpoint.
+    """
+
+    # Per-chat buckets are pruned once this many are tracked
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: int = 3,
+                 group_rate: float = 20 / 60, max_retries: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 30):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._waiting = []
+        self._counter = itertools.count()
+        self._condition: Optional[asyncio.Condition] = None
+        self._paused_until = 0.0
+
+    async def initialize(self):
+        """Create loop-bound primitives"""
+        self._condition = asyncio.Condition()
+
+    async def shutdown(self):
+        """Nothing to clean up"""
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.MAX_CHAT_BUCKETS:
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if not value.is_full()
+                }
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            if is_private:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            else:
+                bucket = TokenBucket(self.group_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _wait_chat_slot(self, chat_id):
+        """Respect the per-chat message limit"""
+        bucket = self._chat_bucket(chat_id)
+        delay = bucket.delay()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = bucket.delay()
+        bucket.consume()
+
+    async def _wait_global_slot(self, priority: int):
+        """Wait for a global slot; higher priorities are always served first"""
+        if self._condition is None:
+            await self.initialize()
+
+        entry = (priority, next(self._counter))
+        heapq.heappush(self._waiting, entry)
+
+        async with self._condition:
+            try:
+                while True:
+                    timeout = None
+                    if self._waiting[0] == entry:
+                        timeout = max(
+                            self._paused_until - time.monotonic(),
+                            self._global_bucket.delay()
+                        )
+                        if timeout <= 0:
+                            heapq.heappop(self._waiting)
+                            self._global_bucket.consume()
+                            return
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                if entry in self._waiting:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                raise
+            finally:
+                self._condition.notify_all()
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with jitter"""
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.5)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        """Queue, send and retry a single Bot API request"""
+        with phase("api"):
+            return await self._process_request(callback, args, kwargs, endpoint, data, rate_limit_args)
+
+    async def _process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        rate_limit_args = rate_limit_args or {}
+        priority = rate_limit_args.get(
+            "priority", ENDPOINT_PRIORITIES.get(endpoint, Priority.INTERACTIVE)
+        )
+        chat_id = data.get("chat_id")
+        chat_limited = chat_id is not None and endpoint.startswith(CHAT_LIMITED_PREFIXES)
+
+        for attempt in itertools.count():
+            if chat_limited:
+                await self._wait_chat_slot(chat_id)
+            await self._wait_global_slot(priority)
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                if attempt >= self.max_retries:
+                    raise
+                delay = exc.retry_after + random.uniform(0, 1)
+                # Flood control applies to the whole bot, so hold everything back
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                logger.warning(f"Flood control on {endpoint}, pausing requests for {delay:.1f}s")
+                await asyncio.sleep(delay)
+            except TimedOut as exc:
+                if attempt >= self.max_retries or not safe_to_retry(endpoint, exc):
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"{endpoint} timed out, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
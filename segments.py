@@ -0,0 +1,92 @@
+"""
+Audience segments for targeted broadcasts.
+
+A segment is a dict of filters over `users` (and `downloads`), all of which
+must match:
+    {"active_days": 7}                  last activity within the last 7 days
+    {"downloaded_book": "ABC123"}       downloaded the given book
+    {"never_downloaded": True}          has not downloaded anything yet
+    {"joined_after": datetime(...)}     first /start after the given moment
+    {"joined_within_days": 7}           first /start within the last 7 days
+    {"include_unreachable": True}       also users who blocked the bot
+An empty dict is every user who can still be messaged.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Segments offered in the admin panel, with their sizes precomputed
+PRESET_SEGMENTS = {
+    "all": {},
+    "active_7": {"active_days": 7},
+    "active_30": {"active_days": 30},
+    "new_7": {"joined_within_days": 7},
+    "never_downloaded": {"never_downloaded": True},
+}
+
+def build_segment_filter(segment: Dict) -> Tuple[str, List]:
+    """SQL WHERE clause (over `users u`) and its parameters for a segment"""
+    clauses = []
+    params = []
+    now = datetime.now()
+
+    if not segment.get("include_unreachable"):
+        clauses.append("u.is_reachable = 1")
+
+    if segment.get("active_days") is not None:
+        clauses.append("u.last_activity >= ?")
+        params.append(now - timedelta(days=segment["active_days"]))
+
+    if segment.get("downloaded_book"):
+        clauses.append("u.user_id IN (SELECT user_id FROM downloads WHERE book_code = ?)")
+        params.append(segment["downloaded_book"].upper())
+
+    if segment.get("never_downloaded"):
+        clauses.append("u.total_downloads = 0")
+
+    if segment.get("joined_after") is not None:
+        clauses.append("u.started_at >= ?")
+        params.append(segment["joined_after"])
+
+    if segment.get("joined_within_days") is not None:
+        clauses.append("u.started_at >= ?")
+        params.append(now - timedelta(days=segment["joined_within_days"]))
+
+    return " AND ".join(clauses) or "1", params
+
+class SegmentSizes:
+    """Precomputed user counts for the preset segments"""
+
+    def __init__(self):
+        self.sizes: Dict[str, int] = {}
+        self.updated_at = None
+
+    async def refresh(self, db_manager):
+        started = time.perf_counter()
+        sizes = {}
+        for key, segment in PRESET_SEGMENTS.items():
+            sizes[key] = await db_manager.count_segment(segment)
+        self.sizes = sizes
+        self.updated_at = datetime.now()
+        logger.debug(f"Segment sizes refreshed in {time.perf_counter() - started:.2f}s")
+
+    async def get(self, db_manager) -> Dict[str, int]:
+        """Cached sizes, computed once on first use"""
+        if not self.sizes:
+            await self.refresh(db_manager)
+        return self.sizes
+
+    async def refresh_forever(self, db_manager, interval: float):
+        """Background task keeping the sizes fresh"""
+        while True:
+            try:
+                await self.refresh(db_manager)
+            except Exception as e:
+                logger.error(f"Failed to refresh segment sizes: {e}")
+            await asyncio.sleep(interval)
+
+segment_sizes = SegmentSizes()
@@ -9,11 +9,13 @@ from telegram.error import BadRequest
 from config import REQUIRED_CHANNELS, CHANNEL_IDS, CHANNEL_NAMES
 from utils.check_subs import check_user_subscriptions
 from database.db_manager import DatabaseManager
+from handlers.books import deliver_book
+from handlers.inline import INLINE_START_PARAMETER
 
 db_manager = DatabaseManager()
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /start command"""
+    """Handle /start command, including t.me/<bot>?start=<CODE> deep links"""
     user = update.effective_user
     
     # Add user to database
@@ -24,6 +26,19 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         last_name=user.last_name
     )
     
+    # Deep link: remember the requested book until it can be delivered
+    if context.args and context.args[0] != INLINE_START_PARAMETER:
+        context.user_data['pending_book_code'] = context.args[0].strip().upper()
+    
+    pending_code = context.user_data.get('pending_book_code')
+    if pending_code:
+        is_subscribed = await check_user_subscriptions(context.bot, user.id, list(CHANNEL_IDS.values()))
+        if is_subscribed:
+            context.user_data.pop('pending_book_code', None)
+            context.user_data['expecting_book_code'] = True
+            await deliver_book(update.message, user.id, pending_code, context)
+            return
+    
     # Create inline keyboard with channel links
     keyboard = []
     
@@ -57,13 +72,21 @@ async def subscription_callback(update: Update, context: ContextTypes.DEFAULT_TY
         is_subscribed = await check_user_subscriptions(context.bot, user_id, list(CHANNEL_IDS.values()))
         
         if is_subscribed:
+            # Store user state to expect book code
+            context.user_data['expecting_book_code'] = True
+            
+            # A book requested through a deep link is delivered right away
+            pending_code = context.user_data.pop('pending_book_code', None)
+            if pending_code:
+                await query.edit_message_text("✅ Rahmat! Barcha kanallarga obuna bo'ldingiz.")
+                await deliver_book(query.message, user_id, pending_code, context)
+                return
+            
             # User is subscribed to all channels
             await query.edit_message_text(
                 "✅ Rahmat! Barcha kanallarga obuna bo'ldingiz.\n\n"
                 "📝 Endi kitob kodini yuboring (masalan: ABC123):"
             )
-            # Store user state to expect book code
-            context.user_data['expecting_book_code'] = True
         else:
             # User is not subscribed to all channels
             keyboard = [[InlineKeyboardButton("🔁 Qayta tekshirish", callback_data="check_subscription")]]
@@ -0,0 +1,295 @@
+"""
+Multi-process mode: a front process receives updates and dispatches them to
+worker processes, sharded by user so each user's conversation state stays in
+one worker. Crashed workers are restarted and their heartbeats are
+aggregated for the health check.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from typing import Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import Updater
+
+from config import LOG_LEVEL, LOG_SAMPLE_RATE
+from utils.lifecycle import Backlog, fetch_updates, install_stop_handlers
+from utils.logging_setup import setup_worker_logging, listen_for_worker_logs
+
+logger = logging.getLogger(__name__)
+
+# Workers start from a fresh interpreter instead of forking a process that
+# already has threads and a running event loop
+_mp = multiprocessing.get_context("spawn")
+
+def shard_for(update: Update, count: int) -> int:
+    """Worker index for an update; all updates of one user go to the same worker"""
+    user = update.effective_user
+    key = user.id if user else update.update_id
+    return key % count
+
+def worker_main(index: int, count: int, factory, updates, status, log_queue,
+                heartbeat_interval: float):
+    """Entry point of a worker process.
+
+    `factory(count)` is a coroutine function returning the worker's
+    LifecycleManager; it is run in the worker, so it must be importable."""
+    # Ctrl+C reaches the whole process group, but shutdown is driven by the front
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_worker_logging(LOG_LEVEL, log_queue, sample_rate=LOG_SAMPLE_RATE)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(_run_worker(index, count, factory, updates, status, heartbeat_interval))
+
+async def _run_worker(index, count, factory, updates, status, heartbeat_interval):
+    lifecycle = await factory(count)
+    parent = os.getppid()
+    received = 0
+
+    async def heartbeat():
+        while True:
+            status.put({
+                "worker": index,
+                "pid": os.getpid(),
+                "ts": time.time(),
+                "received": received,
+                "pending": lifecycle.app.update_queue.qsize(),
+            })
+            await asyncio.sleep(heartbeat_interval)
+
+    async def feed(app):
+        nonlocal received
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                data = await loop.run_in_executor(None, updates.get, True, 1)
+            except queue.Empty:
+                if os.getppid() != parent:
+                    logger.warning(f"Worker {index}: front process is gone, stopping")
+                    return
+                continue
+            if data is None:
+                return
+            received += 1
+            await app.update_queue.put(Update.de_json(data, app.bot))
+
+    lifecycle.add_background_task(heartbeat)
+    logger.info(f"👷 Worker {index} started (pid {os.getpid()})")
+    await lifecycle.run_fed(feed)
+    logger.info(f"👷 Worker {index} stopped after {received} updates")
+
+class WorkerPool:
+    """Front process side: starts, feeds and supervises the worker processes"""
+
+    # A worker dying sooner than this after start counts as a crash loop
+    CRASH_WINDOW = 30
+    MAX_RESTART_DELAY = 30
+
+    def __init__(self, factory, count: int, heartbeat_interval: float = 5,
+                 drain_timeout: float = 8, backlog_batch_size: int = 100):
+        self.factory = factory
+        self.count = count
+        self.heartbeat_interval = heartbeat_interval
+        self.drain_timeout = drain_timeout
+        self.backlog_batch_size = backlog_batch_size
+        self.dispatched = 0
+        self.status = {}
+        self._stopping = False
+
+        self._log_queue = _mp.Queue()
+        self._status_queue = _mp.Queue()
+        self._queues = [_mp.Queue() for _ in range(count)]
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * count
+        self._started_at = [0.0] * count
+        self._next_start = [0.0] * count
+        self._crashes = [0] * count
+        self._restarts = [0] * count
+        self._lost = [0] * count
+        self._heartbeats: Dict[int, dict] = {}
+
+    def _start_worker(self, index: int):
+        process = _mp.Process(
+            target=worker_main,
+            args=(index, self.count, self.factory, self._queues[index],
+                  self._status_queue, self._log_queue, self.heartbeat_interval),
+            name=f"bot-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+
+    def _reap(self, index: int):
+        """Handle a worker that exited unexpectedly and schedule its restart"""
+        process = self._processes[index]
+        self._processes[index] = None
+        self._restarts[index] += 1
+
+        # The dead worker may have held the queue's read lock, so it can't be
+        # reused; whatever was still queued for it is lost
+        old_queue = self._queues[index]
+        try:
+            lost = old_queue.qsize()
+        except NotImplementedError:
+            lost = 0
+        old_queue.cancel_join_thread()
+        old_queue.close()
+        self._queues[index] = _mp.Queue()
+        self._lost[index] += lost
+        self._heartbeats.pop(index, None)
+
+        if time.monotonic() - self._started_at[index] < self.CRASH_WINDOW:
+            self._crashes[index] += 1
+            delay = min(self.MAX_RESTART_DELAY, 2 ** self._crashes[index])
+        else:
+            self._crashes[index] = 0
+            delay = 0
+        self._next_start[index] = time.monotonic() + delay
+        logger.error(
+            f"💥 Worker {index} exited with code {process.exitcode}, "
+            f"{lost} queued updates lost, restarting in {delay}s"
+        )
+
+    def _collect_heartbeats(self):
+        while True:
+            try:
+                beat = self._status_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._heartbeats[beat["worker"]] = beat
+
+    def _build_status(self) -> dict:
+        now = time.time()
+        workers = []
+        for index, process in enumerate(self._processes):
+            beat = self._heartbeats.get(index)
+            alive = process is not None and process.is_alive()
+            fresh = beat is not None and now - beat["ts"] < 3 * self.heartbeat_interval
+            workers.append({
+                "worker": index,
+                "pid": process.pid if alive else None,
+                "healthy": alive and fresh,
+                "last_heartbeat_s": round(now - beat["ts"], 1) if beat else None,
+                "received": beat["received"] if beat else 0,
+                "pending": beat["pending"] if beat else 0,
+                "restarts": self._restarts[index],
+                "lost_updates": self._lost[index],
+            })
+
+        healthy = sum(worker["healthy"] for worker in workers)
+        if healthy == self.count:
+            state = "healthy"
+        elif healthy:
+            state = "degraded"
+        else:
+            state = "unhealthy"
+        return {
+            "status": state,
+            "workers_healthy": f"{healthy}/{self.count}",
+            "dispatched": self.dispatched,
+            "workers": workers,
+        }
+
+    async def _supervise(self):
+        while True:
+            self._collect_heartbeats()
+            now = time.monotonic()
+            for index, process in enumerate(self._processes):
+                if self._stopping:
+                    break
+                if process is not None and not process.is_alive():
+                    self._reap(index)
+                if self._processes[index] is None and now >= self._next_start[index]:
+                    self._start_worker(index)
+            self.status = self._build_status()
+            await asyncio.sleep(1)
+
+    def dispatch(self, update: Update):
+        """Hand an update to the worker that owns its user"""
+        # Pickling happens on the queue's feeder thread, not on the event loop
+        self._queues[shard_for(update, self.count)].put(update.to_dict())
+        self.dispatched += 1
+
+    async def catch_up(self, bot, allowed_updates, stopping=None) -> int:
+        """Dispatch updates that queued up while the bot was down, with
+        duplicates collapsed as in single-process mode"""
+        backlog = Backlog(lambda offset: fetch_updates(
+            bot, offset, self.backlog_batch_size, 0, allowed_updates, stopping=stopping
+        ))
+        async for per_user in backlog.batches():
+            for user_updates in per_user:
+                for update in user_updates:
+                    self.dispatch(update)
+        backlog.log_summary()
+        return backlog.total
+
+    async def _intake(self, update_queue: asyncio.Queue):
+        while True:
+            update = await update_queue.get()
+            try:
+                self.dispatch(update)
+            finally:
+                update_queue.task_done()
+
+    async def _stop_workers(self):
+        """Let every worker drain its queue and shut down, within the deadline"""
+        self._stopping = True
+        for update_queue in self._queues:
+            update_queue.put(None)
+
+        loop = asyncio.get_running_loop()
+        # Workers drain for up to drain_timeout; allow a little more to stop
+        deadline = time.monotonic() + self.drain_timeout + 5
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"⚠️ Worker {index} did not stop in time, terminating")
+                process.terminate()
+
+    async def run(self, bot, allowed_updates, webhook: Optional[dict] = None, background=(),
+                  update_queue: Optional[asyncio.Queue] = None):
+        """Receive updates (polling, or a webhook if `webhook` holds the
+        Updater.start_webhook arguments) and dispatch them until stopped.
+        `background` coroutine functions run alongside and are cancelled on shutdown."""
+        log_listener = listen_for_worker_logs(self._log_queue)
+        stop = asyncio.Event()
+        install_stop_handlers(stop.set)
+
+        for index in range(self.count):
+            self._start_worker(index)
+        if update_queue is None:
+            update_queue = asyncio.Queue()
+        tasks = [asyncio.create_task(self._supervise()), asyncio.create_task(self._intake(update_queue))]
+        tasks += [asyncio.create_task(coroutine_function()) for coroutine_function in background]
+
+        try:
+            updater = Updater(bot, update_queue)
+            async with updater:
+                if webhook:
+                    await updater.start_webhook(
+                        allowed_updates=allowed_updates, drop_pending_updates=False, **webhook
+                    )
+                else:
+                    await self.catch_up(bot, allowed_updates, stopping=stop.is_set)
+                    await updater.start_polling(
+                        allowed_updates=allowed_updates, drop_pending_updates=False
+                    )
+                logger.info(f"🤖 Bot is running, dispatching updates to {self.count} workers")
+
+                await stop.wait()
+                logger.info("🛑 Shutting down: no longer accepting updates")
+                await updater.stop()
+
+            # Forward what was already received, then let the workers drain
+            await update_queue.join()
+            await self._stop_workers()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            log_listener.stop()